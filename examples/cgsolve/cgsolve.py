@@ -7,6 +7,7 @@ import math
 import random
 import sys
 
+import wayout
 import kernel
 from kernel import *
 
@@ -72,6 +73,7 @@ def run() -> None:
     parser.add_argument('-M', type=int, help="Unused")
     parser.add_argument('--cuda', action="store_true", help="use CUDA (default: 0)")
     parser.add_argument('--file', type=str, help="output timing info to file")
+    parser.add_argument('--fuse', action="store_true", help="fuse BLAS-1 calls of the solver loop")
 
     args = parser.parse_args()
     if args.N:
@@ -124,23 +126,26 @@ def run() -> None:
 
     k = 0
 
+    # defers the axpys into the following dot
+    blas = wayout.fusion.lazy(KokkosBlas) if args.fuse else KokkosBlas
+
     while tolerance < norm_res and k < N:
         # Ap = A * p
         KokkosSparse.spmv(char_ptr("N"), one, A, p, zero, Ap); Kokkos.fence()
         # pAp_dot = p' * A*p
-        pAp_dot: float = KokkosBlas.dot(p, Ap); Kokkos.fence()
+        pAp_dot: float = blas.dot(p, Ap); Kokkos.fence()
         alpha: float = r_old_dot / pAp_dot
 
         # x = x + alpha*p
-        KokkosBlas.axpy(alpha, p, x)
+        blas.axpy(alpha, p, x)
         # r = r + -alpha*A*p
-        KokkosBlas.axpy(-alpha, Ap, r)
+        blas.axpy(-alpha, Ap, r)
 
-        r_dot: float = KokkosBlas.dot(r, r)
+        r_dot: float = blas.dot(r, r)
         beta: float = r_dot / r_old_dot
 
         # p = r + beta*p
-        KokkosBlas.axpby(one, r, beta, p)
+        blas.axpby(one, r, beta, p)
         r_old_dot = r_dot
         norm_res = math.sqrt(r_old_dot)
 
@@ -85,18 +85,12 @@ def generate9pt():
         rowmap[vert+1] = len(colinds)
 
     numEdges = len(colinds)
-    rowmapHost: pk.View1D = pk.View([numVertices + 1], pk.int32, space=pk.HostSpace)
-    colindsHost: pk.View1D = pk.View([numEdges], pk.int32, space=pk.HostSpace)
-
-    # TODO init view from numpy array
-    np.copyto(rowmapHost.data, rowmap)
-    np.copyto(colindsHost.data, np.array(colinds))
-
     rowmapDevice = pk.View([numVertices + 1], pk.int32)
     colindsDevice = pk.View([numEdges], pk.int32)
 
-    deep_copy(rowmapDevice, rowmapHost)
-    deep_copy(colindsDevice, colindsHost)
+    # numpy arrays are passed as unmanaged host views
+    deep_copy(rowmapDevice, rowmap)
+    deep_copy(colindsDevice, np.array(colinds, dtype=np.int32))
 
     return rowmapDevice, colindsDevice
 
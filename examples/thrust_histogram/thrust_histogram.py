@@ -2,13 +2,14 @@ from kernels import *
 from wayout.dynamic import Timer
 
 import argparse
+import numpy as np
 
 # simple routine to print contents of a vector
 def print_vector(name, v):
     h_vec = host_vector(int)(v)
     print("  %20s  " % (name), end='')
-    for i in range(v.size()):
-        print(f" {h_vec[i]}", end='')
+    for x in np.asarray(h_vec):
+        print(f" {x}", end='')
     print()
   
 
@@ -1,5 +1,6 @@
 from kernels import *
 from wayout.dynamic import Timer
+import wayout
 
 import argparse
 
@@ -12,6 +13,11 @@ def saxpy_slow(A, X, Y):
 
     transform(temp.begin(), temp.end(), Y.begin(), Y.begin(), plus(float)())
 
+def saxpy_fast(A, X, Y):
+    saxpy = wayout.functor("double a", "(x, y) -> a * x + y")
+
+    transform(X.begin(), X.end(), Y.begin(), Y.begin(), saxpy(A))
+
 def run() -> None: 
     parser = argparse.ArgumentParser()
     parser.add_argument('-N', type=int, 
@@ -19,6 +25,7 @@ def run() -> None:
     parser.add_argument('-M', type=int, default=1, help="iteration")
     parser.add_argument('--cuda', action="store_true", help="use CUDA (default: 0)")
     parser.add_argument('--file', type=str, help="output timing info to file")
+    parser.add_argument('--fast', action="store_true", help="single pass saxpy using a functor")
 
     args = parser.parse_args()
     N = 4
@@ -44,9 +51,10 @@ def run() -> None:
     for i in range(args.M):
         # X = device_vector(float)(x)
         # Y = device_vector(float)(y)
-        saxpy_slow(2.0, X, Y)
-       
-        # saxpy_fast not implemented because functor required
+        if args.fast:
+            saxpy_fast(2.0, X, Y)
+        else:
+            saxpy_slow(2.0, X, Y)
 
     # copy(Y.begin(), Y.end(), y.begin())
     # for i in range(4):
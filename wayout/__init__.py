@@ -1,4 +1,8 @@
 from . import static, dynamic
+from . import fusion
+from .tracing import trace
+from .functor import functor
+from .transpile import to_functor
 
 def _get_cpp_view_name(view):
     rank = view.rank()
@@ -55,6 +59,25 @@ def _get_cpp_view_name(view):
     return cpp_type
 
 
+# cpp view names keyed by view configuration
+_cpp_view_names = {}
+def _get_cached_cpp_view_name(view):
+    # views are re-wrapped on resize, so the handle doubles as a version tag
+    array = view.array
+    cached = getattr(view, "_cpp_name_cache", None)
+    if cached is not None and cached[0] is array:
+        return cached[1]
+
+    key = (type(array), view.dtype, view.layout, view.space, view.trait, view.rank())
+    cpp_name = _cpp_view_names.get(key)
+    if cpp_name is None:
+        cpp_name = _get_cpp_view_name(view)
+        _cpp_view_names[key] = cpp_name
+
+    view._cpp_name_cache = (array, cpp_name)
+    return cpp_name
+
+
 def _from_handle(handle):
     # cast views
     params = type(handle).__name__.split("_")
@@ -68,6 +91,16 @@ def _from_handle(handle):
     return pk.View(handle.shape, dtype, layout=layout, space=space, array=handle)
 
 
+# unmanaged host view over the memory of a numpy array, no copy (0-d arrays
+# are passed as scalars)
+def _view_from_numpy(array):
+    if array.ndim == 0:
+        return array[()]
+    if not array.flags["C_CONTIGUOUS"]:
+        raise ValueError("Only C-contiguous numpy arrays can be passed as views!")
+    return pk.from_numpy(array, space=MemorySpace.HostSpace, layout=Layout.LayoutRight)
+
+
 try:
     # insert hooks if pykokkos is present
     import pykokkos as pk
@@ -75,10 +108,15 @@ try:
     from pykokkos.bindings import kokkos as lib
 
     pk.View._handle = property(lambda v: v.array)
-    pk.View._cpp_name = property(lambda v: _get_cpp_view_name(v))
+    pk.View._cpp_name = property(_get_cached_cpp_view_name)
     pk.View._from_handle = _from_handle 
     dynamic.register_manual_wrapper(pk.View, "KokkosView")
 
+    import numpy as np
+    # only for parameters declared as host space views, other parameters
+    # (e.g. of thrust or device views) get the array as is
+    dynamic.register_arg_adapter(np.ndarray, _view_from_numpy, dynamic.HostView)
+
 except ModuleNotFoundError:
     pass
     
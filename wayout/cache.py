@@ -0,0 +1,187 @@
+"""
+cache.py
+
+user level cache of built binding modules shared by all build directories,
+keyed by the generated source, the build directory headers it includes, the
+headers outside of it (see get_external_headers), the Makefile and the
+compiler, artifacts are hard linked (or copied) on a hit and
+least recently used ones are evicted beyond the size cap
+
+    WAYOUT_CACHE=0          disables the cache
+    WAYOUT_CACHE_DIR        location (default: ~/.cache/wayout)
+    WAYOUT_CACHE_SIZE       size cap in MB (default: 4096)
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from .static import PCH_HEADER
+
+enabled = os.environ.get("WAYOUT_CACHE", "1") != "0"
+cache_dir = os.environ.get("WAYOUT_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "wayout")
+max_size = int(os.environ.get("WAYOUT_CACHE_SIZE", 4096)) * 1024 * 1024
+
+_local_include_patt = re.compile(r'^#include "(.*)"', re.MULTILINE)
+_absolute_include_patt = re.compile(r'^#include <(/.*)>', re.MULTILINE)
+_cxx_patt = re.compile(r"^CXX\s*=\s*(.*?)\s*$", re.MULTILINE)
+
+# compiler command -> version output
+_compiler_ids = {}
+# serializes eviction within the process
+_evict_lock = threading.Lock()
+# (path, mtime, size) -> content hash of headers outside the build directory
+_file_hashes = {}
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def compiler_id(makefile):
+    match = _cxx_patt.search(makefile.decode('utf-8', 'replace'))
+    cxx = match.group(1) if match else "c++"
+    if cxx not in _compiler_ids:
+        try:
+            _compiler_ids[cxx] = subprocess.run(cxx.split() + ["--version"], capture_output=True).stdout
+        except OSError:
+            _compiler_ids[cxx] = cxx.encode('utf-8')
+    return _compiler_ids[cxx]
+
+
+def file_hash(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return b""
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    digest = _file_hashes.get(key)
+    if digest is None:
+        digest = _file_hashes[key] = hashlib.sha1(_read(path)).digest()
+    return digest
+
+
+# prerequisites listed in a dependency file written by the compiler
+def read_deps(path):
+    with open(path) as f:
+        text = f.read().replace("\\\n", " ")
+    deps = []
+    for line in text.splitlines():
+        _, sep, prereqs = line.partition(": ")
+        if sep:
+            deps.extend(prereqs.split())
+    return deps
+
+
+# headers outside the build directory used by its bindings, edits to them
+# invalidate cached modules as removing the build directory used to: all
+# headers of the precompiled header as found by the compiler (g++ targets)
+# and headers included by absolute path (e.g. init_vec.hpp of the thrust
+# examples)
+def get_external_headers(build_dir, absolute_includes):
+    headers = set(absolute_includes)
+    deps_path = os.path.join(build_dir, f"{PCH_HEADER}.d")
+    if os.path.exists(deps_path):
+        headers.update(os.path.normpath(os.path.join(build_dir, dep)) for dep in read_deps(deps_path))
+    return sorted(headers)
+
+
+def get_key(build_dir, name):
+    """key of building build_dir/<name>.so from build_dir/<name>.cpp"""
+    key = hashlib.sha1()
+    makefile = _read(os.path.join(build_dir, "Makefile"))
+    key.update(makefile)
+    key.update(compiler_id(makefile))
+    # commands with variables expanded, covers flags and paths from the environment
+    key.update(subprocess.run(['make', '-s', '-n', '-B', '-C', build_dir, f"TARGET={name}.so"],
+            capture_output=True).stdout)
+
+    # headers of the build directory
+    pending = [f"{name}.cpp"]
+    seen = set()
+    absolute_includes = set()
+    while pending:
+        file_name = pending.pop()
+        path = os.path.join(build_dir, file_name)
+        if file_name in seen or not os.path.exists(path):
+            continue
+        seen.add(file_name)
+
+        content = _read(path)
+        key.update(file_name.encode('utf-8'))
+        key.update(content)
+        text = content.decode('utf-8', 'replace')
+        pending.extend(_local_include_patt.findall(text))
+        absolute_includes.update(_absolute_include_patt.findall(text))
+
+    for path in get_external_headers(build_dir, absolute_includes):
+        key.update(path.encode('utf-8'))
+        key.update(file_hash(path))
+    return key.hexdigest()
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # other file system
+        shutil.copy2(src, dst)
+
+
+def fetch(key, path):
+    """place the cached module of key at path, False on a miss"""
+    cached = os.path.join(cache_dir, f"{key}.so")
+    try:
+        # mtime tracks the last use
+        os.utime(cached)
+        if os.path.lexists(path):
+            os.remove(path)
+        _link(cached, path)
+    except OSError:
+        return False
+    return True
+
+
+def store(key, path):
+    """add module at path under key, evicting old modules beyond the size cap"""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        cached = os.path.join(cache_dir, f"{key}.so")
+
+        # other processes only ever see complete modules
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        os.close(fd)
+        os.remove(tmp)
+        _link(path, tmp)
+        os.replace(tmp, cached)
+        evict()
+    except OSError:
+        # the cache is best effort, the module is built either way
+        pass
+
+
+def evict():
+    with _evict_lock:
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".so"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(s for _, s, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
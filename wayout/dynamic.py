@@ -1,15 +1,22 @@
-import copy
 import enum
 import ctypes
 import hashlib
 import importlib
+import json
 import os
 import re
 import typing
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from . import cache
+# build directory headers generated by static
+from .static import CLASSES_HEADER, PCH_HEADER
 
 # benchmark info
 import time
+from glob import glob
 
 class Timer:
     def __init__(self):
@@ -22,8 +29,8 @@ class Timer:
     def reset(self) -> None:
         self.start_time = time.perf_counter()
 
+# summed over all builds, also when they run concurrently
 total_build_time = 0
-timer = Timer()
 generated_ctors = set()
 generated_kernels = set()
 
@@ -54,6 +61,9 @@ class Operator(enum.Enum):
     SET_ITEM = "SET_ITEM_"
     CALL = "CALL_"
     DEREF = "DEREF_"
+    # vectorized __getitem__/__setitem__ over index arrays
+    GATHER = "GATHER_"
+    SCATTER = "SCATTER_"
 
 
 _cpp_types = {
@@ -66,17 +76,179 @@ _cpp_types = {
     type(None): "void",
 }
 
+# python types of the numpy scalars bound to their exact cpp type
+_numpy_scalar_types = set()
+
+# numpy dtype -> cpp type of numpy scalars and of index/value arrays passed to
+# gather and scatter
+_numpy_cpp_types = {
+    "bool": "bool",
+    "int8": "std::int8_t",
+    "int16": "std::int16_t",
+    "int32": "std::int32_t",
+    "int64": "std::int64_t",
+    "uint8": "std::uint8_t",
+    "uint16": "std::uint16_t",
+    "uint32": "std::uint32_t",
+    "uint64": "std::uint64_t",
+    "float32": "float",
+    "float64": "double",
+}
+
+try:
+    import numpy as _np
+    # numpy scalars (e.g. results of reductions) bind to their exact cpp type
+    for dtype, typename in _numpy_cpp_types.items():
+        _cpp_types[_np.dtype(dtype).type] = typename
+        _numpy_scalar_types.add(_np.dtype(dtype).type)
+except ModuleNotFoundError:
+    _np = None
 
+
+# serializes loading of built modules, other threads only see them loaded
+_import_lock = threading.RLock()
 def import_module(lib_path, mod_name):
-    spec = importlib.util.spec_from_file_location(mod_name, lib_path)
-    if spec is None:
-        raise ModuleNotFoundError
-    module = importlib.util.module_from_spec(spec)
-    sys.modules[mod_name] = module
-    spec.loader.exec_module(module)
+    with _import_lock:
+        if mod_name in sys.modules:
+            return
+        spec = importlib.util.spec_from_file_location(mod_name, lib_path)
+        if spec is None:
+            raise ModuleNotFoundError
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[mod_name] = module
+
+
+# default for bindings called without an explicit release_gil, when set
+# native calls drop the GIL so other python threads keep running
+release_gil_default = False
+_NOGIL_SUFFIX = "_nogil"
+
+# resolved pybind callables keyed by python-side signature
+_dispatch_cache = {}
+
+# active tracing.Trace of each thread (as tracer), records calls of that
+# thread instead of running them, other threads keep calling natively
+_trace_state = threading.local()
+def get_tracer():
+    return getattr(_trace_state, "tracer", None)
+
+
+def set_tracer(tracer):
+    _trace_state.tracer = tracer
+
+
+# constructors and operators run eagerly, a trace cannot record them
+def check_not_tracing(what):
+    if get_tracer() is not None:
+        raise RuntimeError(f"{what} is not supported while tracing, run it before the trace!")
+
+
+# runs operations deferred by fusion.lazy, which other calls may depend on
+_pending_flush = None
+
+# cast of concrete host space Kokkos::View parameters (see
+# static.get_param_casts), numpy arrays passed for them can be wrapped as views
+class HostView:
+    pass
+
+
+# (python type, parameter cast) -> conversion of such arguments into wrapped
+# objects before a call (e.g. numpy arrays to kokkos views), adapters without
+# a cast apply to any parameter, see register_arg_adapter
+_arg_adapters = {}
+_adapted_types = set()
+def register_arg_adapter(arg_cls, adapter, cast=None):
+    _arg_adapters[(arg_cls, cast)] = adapter
+    _adapted_types.add(arg_cls)
+    _dispatch_cache.clear()
+
+
+# 0-d arrays are passed as the scalar they hold
+def _array_scalar(arr):
+    return arr[()] if arr.ndim == 0 else arr
+
+
+def _adapt_arg(arg, cast):
+    adapter = _arg_adapters.get((type(arg), cast)) or _arg_adapters.get((type(arg), None))
+    return arg if adapter is None else adapter(arg)
 
 
-def get_hash(prefix, namespace, args, template_args):
+# casts are the declared parameter types, if known (see canonicalize_args)
+def adapt_args(args, casts=()):
+    for arg in args:
+        if type(arg) in _adapted_types:
+            break
+    else:
+        return args
+
+    casts = tuple(casts) + (None,) * (len(args) - len(casts))
+    return tuple(_adapt_arg(arg, cast) for arg, cast in zip(args, casts))
+
+
+if _np is not None:
+    register_arg_adapter(_np.ndarray, _array_scalar)
+
+
+# coerce a scalar argument to the python type of its declared parameter,
+# integral parameters are not narrowed from floating point arguments
+def _coerce(arg, cast):
+    typename = _cpp_types.get(type(arg))
+    if cast is None or type(arg) is cast or typename in (None, "std::string", "void"):
+        return arg
+    if cast is int and typename in ("float", "double"):
+        return arg
+    return cast(arg)
+
+
+# coerce scalars to the declared parameter types of the overloads taking
+# len(args) arguments, so e.g. scale(1) and scale(1.0) of scale(double) share a
+# binding, template dependent parameters (e.g. the const AV& alpha of
+# KokkosBlas::axpy) keep the type of the argument since it selects the
+# instantiation
+def canonicalize_args(args, param_types):
+    casts = param_types.get(len(args))
+    if casts is None:
+        return args
+    return tuple(_coerce(arg, cast) for arg, cast in zip(args, casts))
+
+
+# append the literal defaults of trailing parameters left out by the caller,
+# so calls with and without optional arguments share a binding
+def fill_default_args(args, default_args):
+    tail = default_args.get(len(args))
+    if tail is None:
+        return args
+    return tuple(args) + tail
+
+
+# cheap hashable stand-in for the cpp type of an argument
+def _arg_key(arg):
+    if type(arg) in _cpp_types:
+        return type(arg)
+    elif isinstance(arg, ptr) or isinstance(arg, char_ptr):
+        return (type(arg), _arg_key(arg.val))
+    elif hasattr(arg, "_cpp_name"):
+        return arg._cpp_name
+    else:
+        return type(arg)
+
+
+def _template_key(template_args):
+    if not template_args:
+        return None
+
+    key = []
+    for arg in template_args:
+        if isinstance(arg, list):
+            arg = tuple(arg)
+        elif hasattr(arg, "_cpp_name"):
+            arg = arg._cpp_name
+        key.append(arg)
+    return tuple(key)
+
+
+def get_hash(prefix, namespace, args, template_args, release_gil=False):
     if namespace:
         prefix = f"{namespace}::{prefix}"
 
@@ -108,13 +280,17 @@ def get_hash(prefix, namespace, args, template_args):
 
     qualified_name = f"{prefix}{template_str}({','.join(cpp_args)})"
 
-    return "f_" + hashlib.sha1(qualified_name.encode('utf-8')).hexdigest()
+    name_hash = "f_" + hashlib.sha1(qualified_name.encode('utf-8')).hexdigest()
+    if release_gil:
+        name_hash += _NOGIL_SUFFIX
+    return name_hash
 
 
-# generate argument casts (expect list of instances) 
-def gen_arg_casts(buf, args):
+# generate typed parameters (expect list of instances) 
+def gen_params(args):
+    params = []
     for i, _arg in enumerate(args):
-        # cast to reference by default
+        # bind to reference by default
         ref = " &"
 
         if isinstance(_arg, ptr) or isinstance(_arg, char_ptr):
@@ -136,7 +312,19 @@ def gen_arg_casts(buf, args):
         else:
             raise TypeError("Unknown cast!", _arg)
 
-        buf.append(f"{typename} a{i} = args[{i}].cast<{typename}>();")
+        params.append(f"{typename} a{i}")
+    return params
+
+
+# generate forwarded arguments, starting from parameter a<offset>
+def gen_call_args(args, offset=0):
+    vargs = []
+    for i, arg in enumerate(args, offset):
+        if isinstance(arg, char_ptr):
+            vargs.append(f"a{i}.c_str()")
+        else:
+            vargs.append(f"a{i}")
+    return ",".join(vargs)
 
 
 # get cpp name of templated class/arg (expect list of instances) 
@@ -172,16 +360,226 @@ def get_cpp_name(prefix, namespace, template_args):
         return prefix
 
 
-# single func for easier changes
+# number of modules compiled in parallel (WAYOUT_COMPILE_WORKERS, defaults to
+# the number of cores), see set_compile_workers
+compile_workers = int(os.environ.get("WAYOUT_COMPILE_WORKERS", 0)) or os.cpu_count() or 1
+_compile_executor = None
+# name_hash -> future of its build, shared by all threads needing the module
+_compile_futures = {}
+# guards executor, futures and total_build_time
+_compile_lock = threading.Lock()
+
+
+def set_compile_workers(workers):
+    global compile_workers, _compile_executor
+    with _compile_lock:
+        compile_workers = workers
+        executor, _compile_executor = _compile_executor, None
+    if executor is not None:
+        # running builds finish, their futures stay valid
+        executor.shutdown(wait=False)
+
+
+# when set (WAYOUT_MANIFEST=1), the source of every compiled binding is
+# appended to build/manifest.jsonl, see wayout.prebuild
+record_manifest = os.environ.get("WAYOUT_MANIFEST", "0") != "0"
+MANIFEST = "manifest.jsonl"
+_include_patt = re.compile(r'^#include [<"](.*)[>"]', re.MULTILINE)
+
+# build directory headers written at runtime (see wayout.functor), a freshly
+# generated build directory lacks them, so the manifest keeps their text
+runtime_headers = set()
+
+
+def record_binding(name_hash):
+    with open(f"build/{name_hash}.cpp") as f:
+        source = f.read()
+    includes = _include_patt.findall(source)
+
+    headers = {}
+    for include in includes:
+        if include in runtime_headers:
+            with open(f"build/{include}") as f:
+                headers[include] = f.read()
+    entry = {"hash": name_hash, "includes": includes, "headers": headers, "source": source}
+    with _compile_lock:
+        with open(f"build/{MANIFEST}", "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+
 import subprocess
-def compile_binding(name_hash):
+
+# precompiled wrapper includes of g++ build directories (see static.generate_pch)
+_pch_lock = threading.Lock()
+_pch_checked = False
+
+
+# bring the precompiled header up to date once per process, before concurrent
+# builds would each try to rebuild it
+def ensure_pch():
+    global _pch_checked
+    with _pch_lock:
+        if _pch_checked:
+            return
+        if os.path.exists(f"build/{PCH_HEADER}"):
+            subprocess.run(['make', '-s', '-C', 'build', f"{PCH_HEADER}.gch"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        _pch_checked = True
+
+
+# includes covered by the precompiled header, None without one
+_pch_includes = False
+def get_pch_includes():
+    global _pch_includes
+    with _pch_lock:
+        if _pch_includes is False:
+            _pch_includes = None
+            if os.path.exists(f"build/{PCH_HEADER}"):
+                with open(f"build/{PCH_HEADER}") as f:
+                    _pch_includes = set(re.findall(r"^#include <(.*)>", f.read(), re.MULTILINE))
+        return _pch_includes
+
+
+# single func for easier changes
+def _build(name_hash, gen_source):
+    global total_build_time
+    build_timer = Timer()
+    if gen_source is not None:
+        gen_source()
+
     # os.system(f"make -s -C build TARGET={name_hash}.so")
     # os.system(f"make -C build TARGET={name_hash}.so")
     try:
-        subprocess.run(['make', '-s', '-C', 'build', f"TARGET={name_hash}.so"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        # identical builds of other build directories
+        cache_key = cache.get_key("build", name_hash) if cache.enabled else None
+        if cache_key is None or not cache.fetch(cache_key, f"build/{name_hash}.so"):
+            ensure_pch()
+            subprocess.run(['make', '-s', '-C', 'build', f"TARGET={name_hash}.so"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+            if cache_key is not None:
+                cache.store(cache_key, f"build/{name_hash}.so")
     except subprocess.CalledProcessError as e:
         print(e.stderr.decode('utf-8'))
         raise e
+    finally:
+        with _compile_lock:
+            total_build_time += build_timer.seconds()
+
+    # versioned overload modules are looked up through their json state, so
+    # only standalone bindings are worth prebuilding
+    if record_manifest and gen_source is not None and not name_hash.startswith("o_"):
+        record_binding(name_hash)
+
+
+def _forget_failed(name_hash, future):
+    # failed builds are retried by the next request
+    if future.exception() is not None:
+        with _compile_lock:
+            if _compile_futures.get(name_hash) is future:
+                del _compile_futures[name_hash]
+
+
+# future of the build of build/<name_hash>.so on the compile executor, writing
+# its source with gen_source first, requests for a module already building
+# share its future
+def compile_binding_async(name_hash, gen_source=None):
+    global _compile_executor
+    with _compile_lock:
+        future = _compile_futures.get(name_hash)
+        if future is not None:
+            return future
+        if _compile_executor is None:
+            _compile_executor = ThreadPoolExecutor(compile_workers, thread_name_prefix="wayout_compile")
+        future = _compile_executor.submit(_build, name_hash, gen_source)
+        _compile_futures[name_hash] = future
+    # outside the lock, runs right away if the build already finished
+    future.add_done_callback(lambda f: _forget_failed(name_hash, f))
+    return future
+
+
+# compile build/<name_hash>.so, blocking until this module is built
+def compile_binding(name_hash, gen_source=None):
+    compile_binding_async(name_hash, gen_source).result()
+
+
+# include lines and remainder of a generated binding source
+def split_includes(source):
+    includes, rest = [], []
+    for line in source.splitlines(True):
+        (includes if line.startswith("#include") else rest).append(line)
+    return includes, "".join(rest)
+
+
+def _build_unity(unity_hash, sources):
+    includes, bodies = [], []
+    for source in sources.values():
+        source_includes, body = split_includes(source)
+        includes.extend(i for i in source_includes if i not in includes)
+        bodies.append(body.rstrip("\n") + "\n")
+    # the precompiled header is only used as the first include
+    includes.sort(key=lambda i: f"\"{PCH_HEADER}\"" not in i)
+
+    def gen_source():
+        with open(f"build/{unity_hash}.cpp", "w") as f:
+            f.writelines(includes + bodies)
+    _build(unity_hash, gen_source)
+
+    # every module of the batch is loaded from the shared object by name
+    for name_hash in sources:
+        path = f"build/{name_hash}.so"
+        if os.path.lexists(path):
+            os.remove(path)
+        os.symlink(f"{unity_hash}.so", path)
+
+
+# writes source as build/<name_hash>.cpp
+def write_source(name_hash, source):
+    def gen_source():
+        with open(f"build/{name_hash}.cpp", "w") as f:
+            f.write(source)
+    return gen_source
+
+
+# completes target with the outcome of source
+def _chain_future(source, target):
+    def done(f):
+        if f.exception() is not None:
+            target.set_exception(f.exception())
+        else:
+            target.set_result(f.result())
+    source.add_done_callback(done)
+
+
+# futures (name_hash -> future) of building the bindings of sources (name_hash
+# -> generated source) as one translation unit build/u_<hash>.so, the shared
+# includes are parsed once and build/<name_hash>.so links to it for each
+# binding, if the batch fails its bindings are built one by one so a single
+# broken binding only fails itself
+def compile_unity_async(sources):
+    global _compile_executor
+    unity_hash = "u_" + hashlib.sha1("".join(sorted(sources)).encode('utf-8')).hexdigest()
+    futures, own = {}, {}
+    with _compile_lock:
+        if _compile_executor is None:
+            _compile_executor = ThreadPoolExecutor(compile_workers, thread_name_prefix="wayout_compile")
+        batch = _compile_executor.submit(_build_unity, unity_hash, sources)
+        # requests for any binding of the batch wait for it, bindings already
+        # building keep their future
+        for name_hash in sources:
+            if name_hash not in _compile_futures:
+                own[name_hash] = _compile_futures[name_hash] = Future()
+            futures[name_hash] = _compile_futures[name_hash]
+
+    def batch_done(batch):
+        for name_hash, future in own.items():
+            if batch.exception() is None:
+                future.set_result(None)
+                continue
+            with _compile_lock:
+                if _compile_futures.get(name_hash) is future:
+                    del _compile_futures[name_hash]
+            _chain_future(compile_binding_async(name_hash, write_source(name_hash, sources[name_hash])), future)
+    # outside the lock, runs right away if the build already finished
+    batch.add_done_callback(batch_done)
+    return futures
 
 
 def register_class(class_name, namespace, template_args, qualified_name = None):
@@ -204,66 +602,144 @@ def register_class(class_name, namespace, template_args, qualified_name = None):
         try:
             import_module(mod_path, mod_name)
         except (ImportError, ModuleNotFoundError):
-            timer.reset()
-            with open(f"build/{name_hash}.cpp", "w") as f:
-                f.write(f"#include \"{class_name}.hpp\"\n")
+            def gen_source():
+                with open(f"build/{name_hash}.cpp", "w") as f:
+                    f.write(f"#include \"{class_name}.hpp\"\n")
 
-                f.write(f"PYBIND11_MODULE({name_hash}, k){{")
-                f.write(f"generate_class<{qualified_name}>(k, \"{name_hash}\", \"{qualified_name}\");}}");
+                    f.write(f"PYBIND11_MODULE({name_hash}, k){{")
+                    f.write(f"generate_{class_name}<{qualified_name}>(k, \"{name_hash}\", \"{qualified_name}\");}}");
 
-            compile_binding(name_hash)
-            global total_build_time
-            total_build_time += timer.seconds()
+            compile_binding(name_hash, gen_source)
 
             import_module(mod_path, mod_name)
     return qualified_name
 
 
-def verify_return_registered(mod):
+def verify_return_registered(mod, suffix=""):
     try:
-        getattr(mod, _DUMMY_RET_FUNC_NAME)()
-    except TypeError as e:
-        _type_err_patt = re.compile(r"-> (.*)")
-        ret_type = re.search(_type_err_patt, str(e)).group(1)
+        ret_type = getattr(mod, _RET_TYPE_ATTR + suffix)
+    except AttributeError:
+        # module built before return types were exported, probe it instead
+        try:
+            ret_type = None
+            getattr(mod, _DUMMY_RET_FUNC_NAME + suffix)()
+        except TypeError as e:
+            _type_err_patt = re.compile(r"-> (.*)")
+            ret_type = re.search(_type_err_patt, str(e)).group(1)
+
+    if ret_type is not None:
         register_class(None, None, None, qualified_name=ret_type)
 
 
+# field (type, name) pairs whose type has been checked
+_registered_fields = set()
+def verify_field_registered(handle, field):
+    key = (type(handle), field)
+    if key not in _registered_fields:
+        field_type = getattr(type(handle), "_field_type", None)
+        if field_type is not None:
+            ret_type = field_type(field)
+        else:
+            # class registered before field types were exported, probe it instead
+            try:
+                ret_type = None
+                getattr(handle, field)
+            except TypeError as e:
+                _type_err_patt = re.compile(r"-> (.*)")
+                ret_type = re.search(_type_err_patt, str(e)).group(1)
+
+        if ret_type is not None:
+            register_class(None, None, None, qualified_name=ret_type)
+        _registered_fields.add(key)
+
+
 _FUNC_NAME = "func"
 _DUMMY_RET_FUNC_NAME = "dummy"
-def gen_pybind_module(f, binding, name_hash, take_ownership):
-    ret_type = f"decltype({_FUNC_NAME}(pybind11::args()))"
+# module attribute holding the return type if it still needs registering
+_RET_TYPE_ATTR = "ret_type"
 
-    binding.append(
-        "template <typename T>"
-        f"std::enable_if_t<!std::is_same<T, void>::value, T> {_DUMMY_RET_FUNC_NAME}() {{"
-            "return T {};"
-        "}"
-        "template <typename T>"
-        f"std::enable_if_t<std::is_same<T, void>::value, T> {_DUMMY_RET_FUNC_NAME}() {{}}"
-    )
 
+# extra k.def arguments of a binding
+def gen_def_options(take_ownership, release_gil):
+    return_policy = "automatic" if take_ownership else "automatic_reference"
+    options = f"pybind11::return_value_policy::{return_policy}"
+    if release_gil:
+        options += ", pybind11::call_guard<pybind11::gil_scoped_release>()"
+    return options
+
+
+# register return type of func at import if possible, otherwise export it
+# for verify_return_registered to build a class module
+def gen_ret_type_attr(func, name_hash, suffix="", cpp_type=None):
+    cpp_type = f"\"{cpp_type}\"" if cpp_type else "nullptr"
+    return (f"k.attr(\"{_RET_TYPE_ATTR}{suffix}\") = wayout::register_return<decltype(wayout::ret_type(&{func}))>"
+            f"(k, \"{name_hash}_ret\", {cpp_type});")
+
+
+# headers generated at runtime for the types of args (e.g. functors), after
+# the includes they need, so the generated headers include none of them again
+def get_arg_includes(includes, args):
+    typed_args = [arg for arg in args if getattr(arg, "_cpp_header", None)]
+    if not typed_args:
+        return includes
+
+    includes = list(includes)
+    for arg in typed_args:
+        for include in list(arg._includes) + [f"\"{arg._cpp_header}\""]:
+            if include not in includes:
+                includes.append(include)
+    return includes
+
+
+# include lines of a binding, with a precompiled header it comes first and stands in for the wrapper includes, which may not be guarded
+# against a second inclusion
+def get_include_lines(includes):
+    lines = []
+    pch_includes = get_pch_includes()
+    if pch_includes is not None:
+        lines.append(f"#include \"{PCH_HEADER}\"")
+        includes = [include for include in includes if include not in pch_includes]
+    for include in includes:
+        # quoted includes are headers of the build directory
+        if include.startswith("\""):
+            lines.append(f"#include {include}")
+        else:
+            lines.append(f"#include <{include}>")
+    lines.append(f"#include \"{CLASSES_HEADER}\"")
+    return lines
+
+
+def gen_includes(f, includes):
+    f.writelines(line + "\n" for line in get_include_lines(includes))
+
+
+def gen_pybind_module(f, binding, name_hash, take_ownership, release_gil=False, ret_cpp_type=None):
     f.writelines(binding)
 
-    return_policy = "automatic" if take_ownership else "automatic_reference"
+    func = f"{name_hash}::{_FUNC_NAME}"
     f.write(
         f"PYBIND11_MODULE({name_hash}, k){{"
-            f"k.def(\"{name_hash}\", &{_FUNC_NAME}, pybind11::return_value_policy::{return_policy});"
-            f"k.def(\"{_DUMMY_RET_FUNC_NAME}\", &{_DUMMY_RET_FUNC_NAME}<decltype({_FUNC_NAME}(pybind11::args()))>);"
+            f"k.def(\"{name_hash}\", &{func}, {gen_def_options(take_ownership, release_gil)});"
+            f"{gen_ret_type_attr(func, name_hash, cpp_type=ret_cpp_type)}"
         "}"
     )
 
 
-def call_constructor(cls_inst, args, includes):
-    if cls_inst._handle:
-        if hasattr(cls_inst, '__cpp_call__'):
-            return cls_inst.__cpp_call__(*args)
-        raise RuntimeError("Error: calling constructor on instance is forbidden!")
+# write binding source for func(params) { body }, func lives in a namespace
+# of its own so bindings can share a translation unit (see compile_unity), its
+# return type is deduced unless given (nvcc rejects extended lambdas in
+# functions with a deduced return type)
+def gen_binding(name_hash, includes, params, body, take_ownership, release_gil=False, ret_cpp_type=None, return_type="auto"):
+    with open(f"build/{name_hash}.cpp", "w") as f:
+        gen_includes(f, includes)
 
-    # check binding and generate
-    class_cpp_name = cls_inst._cpp_name
-    generated_ctors.add(class_cpp_name)
+        binding = [f"namespace {name_hash} {{{return_type} {_FUNC_NAME}({','.join(params)}){{", body, "}}"]
+        gen_pybind_module(f, binding, name_hash, take_ownership, release_gil, ret_cpp_type)
 
-    name_hash = get_hash(class_cpp_name, None, args, None)
+
+# import binding module, generating and compiling it on first use, a class
+# returned by it is registered by the same module (cpp name ret_cpp_type)
+def load_binding(name_hash, includes, params, body, take_ownership, release_gil=False, ret_cpp_type=None, return_type="auto"):
     mod_name = f"build.{name_hash}"
     mod_path = f"build/{name_hash}.so"
     if mod_name not in sys.modules:
@@ -271,96 +747,171 @@ def call_constructor(cls_inst, args, includes):
             import_module(mod_path, mod_name)
             verify_return_registered(sys.modules[mod_name])
         except (ImportError, ModuleNotFoundError):
-            timer.reset()
-            with open(f"build/{name_hash}.cpp", "w") as f:
-                for include in includes:
-                    f.write(f"#include <{include}>\n")
+            compile_binding(name_hash, lambda: gen_binding(name_hash, includes, params, body, take_ownership, release_gil, ret_cpp_type, return_type))
 
-                binding = [
-                    f"auto {_FUNC_NAME}(pybind11::args args){{",
-                    # "Kokkos::initialize();"
-                ]
+            import_module(mod_path, mod_name)
+            verify_return_registered(sys.modules[mod_name])
 
-                # create temp for all args for lifetime 
-                gen_arg_casts(binding, args)
+    return sys.modules[mod_name]
 
-                binding.append(f"return new {class_cpp_name} {{")
-                vargs = []
-                for i, arg in enumerate(args):
-                    if isinstance(arg, char_ptr):
-                        vargs.append(f"a{i}.c_str()")
-                    else:
-                        vargs.append(f"a{i}")
 
-                binding.append(",".join(vargs) + "};}")
+# when set, every signature of a free function is registered as an overload of
+# one pybind function living in a single module (o_<hash>_<version>.so), which
+# is rebuilt with all known signatures whenever a new one shows up
+aggregate_overloads = False
 
-                gen_pybind_module(f, binding, name_hash, True)
+# func_hash -> (state, module) of the loaded overload module
+_overload_modules = {}
+_overload_lock = threading.RLock()
 
-            compile_binding(name_hash)
-            global total_build_time
-            total_build_time += timer.seconds()
 
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
-            
+def gen_overload_module(mod_name, state):
+    with open(f"build/{mod_name}.cpp", "w") as f:
+        gen_includes(f, state["includes"])
+
+        # pybind tries overloads in order and its int caster also accepts
+        # bool, so signatures with more bool parameters go first
+        signatures = sorted(state["signatures"].items(),
+                key=lambda item: -sum(p.startswith("bool ") for p in item[1]["params"]))
+
+        defs = []
+        for name_hash, sig in signatures:
+            f.write(f"namespace {name_hash} {{auto {_FUNC_NAME}({','.join(sig['params'])}){{{sig['body']}}}}}")
+
+            func = f"{name_hash}::{_FUNC_NAME}"
+            options = gen_def_options(sig["take_ownership"], sig.get("release_gil", False))
+            defs.append(f"k.def(\"{_FUNC_NAME}\", &{func}, {options});")
+            defs.append(gen_ret_type_attr(func, name_hash, f"_{name_hash}"))
+
+        f.write(f"PYBIND11_MODULE({mod_name}, k){{" + "".join(defs) + "}")
+
+
+def import_overload(func_hash, state):
+    mod_name = f"{func_hash}_{state['version']}"
+    mod_path = f"build/{mod_name}.so"
+    try:
+        import_module(mod_path, f"build.{mod_name}")
+    except (ImportError, ModuleNotFoundError):
+        compile_binding(mod_name, lambda: gen_overload_module(mod_name, state))
+
+        with open(f"build/{func_hash}.json", "w") as f:
+            json.dump(state, f)
+
+        # older versions are superseded by this one, the digit keeps the
+        # modules of the _nogil variant of func_hash out
+        for path in glob(f"build/{func_hash}_[0-9]*"):
+            if not os.path.basename(path).startswith(mod_name + "."):
+                os.remove(path)
+
+        import_module(mod_path, f"build.{mod_name}")
+
+    mod = sys.modules[f"build.{mod_name}"]
+    for name_hash in state["signatures"]:
+        verify_return_registered(mod, f"_{name_hash}")
+    return mod
+
+
+# load overload module of func_hash, adding the signature if it is new
+def load_overload(func_hash, name_hash, includes, params, body, take_ownership, release_gil):
+    # versions of one overload module are built one at a time
+    with _overload_lock:
+        state, mod = _overload_modules.get(func_hash, (None, None))
+        if state is None:
+            try:
+                with open(f"build/{func_hash}.json") as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                state = {"version": 0, "includes": includes, "signatures": {}}
+
+        if name_hash not in state["signatures"]:
+            signatures = dict(state["signatures"])
+            signatures[name_hash] = {"params": params, "body": body,
+                    "take_ownership": take_ownership, "release_gil": release_gil}
+            # earlier signatures may need headers (e.g. of functors) this one does not
+            merged = state["includes"] + [include for include in includes if include not in state["includes"]]
+            state = {"version": state["version"] + 1, "includes": merged, "signatures": signatures}
+            mod = None
+
+        if mod is None:
+            mod = import_overload(func_hash, state)
+            _overload_modules[func_hash] = (state, mod)
+
+        return mod
+
+
+# create wrapper instance around handle, bypassing __init__
+def wrap_handle(cls, handle, cpp_name):
+    inst = cls.__new__(cls)
+    inst._handle = handle
+    inst._cpp_name = cpp_name
+    return inst
+
+
+def call_constructor(cls_inst, args, includes):
+    if cls_inst._handle:
+        if hasattr(cls_inst, '__cpp_call__'):
+            return cls_inst.__cpp_call__(*args)
+        raise RuntimeError("Error: calling constructor on instance is forbidden!")
+
+    check_not_tracing(f"Constructing {cls_inst._cpp_name}")
+
+    if _pending_flush is not None:
+        _pending_flush()
+
+    # check binding and generate
+    class_cpp_name = cls_inst._cpp_name
+    generated_ctors.add(class_cpp_name)
+
+    args = adapt_args(args)
+    includes = get_arg_includes(includes, (cls_inst,) + tuple(args))
+
+    key = (class_cpp_name, tuple(map(_arg_key, args)))
+    func = _dispatch_cache.get(key)
+    if func is None:
+        name_hash = get_hash(class_cpp_name, None, args, None)
+        body = f"return new {class_cpp_name} {{{gen_call_args(args)}}};"
+        mod = load_binding(name_hash, includes, gen_params(args), body, True, ret_cpp_type=class_cpp_name)
+
+        func = getattr(mod, name_hash)
+        _dispatch_cache[key] = func
+
     # constructor invocation
     args = [get_handle(arg) for arg in args]
-    inst = copy.copy(cls_inst)
-    inst._handle = getattr(sys.modules[mod_name], name_hash)(*args)
-    return inst
+    return wrap_handle(type(cls_inst), func(*args), class_cpp_name)
+
 
+def call_class_func(inst, func_name, args, includes, take_ownership, release_gil=None):
+    if _pending_flush is not None:
+        _pending_flush()
 
-def call_class_func(inst, func_name, args, includes, take_ownership):
     # check binding and generate
     generated_kernels.add(func_name)
 
     if inst._handle is None:
         raise TypeError("Attempted to call function on type object!")
 
-    name_hash = get_hash(inst._cpp_name + func_name, None, args, None)
-    mod_name = f"build.{name_hash}"
-    mod_path = f"build/{name_hash}.so"
-    if mod_name not in sys.modules:
-        try:
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
-        except (ImportError, ModuleNotFoundError):
-            timer.reset()
-            with open(f"build/{name_hash}.cpp", "w") as f:
-                for include in includes:
-                    f.write(f"#include <{include}>\n")
-               
-                binding = [
-                    f"auto {_FUNC_NAME}(pybind11::args args){{",
-                    # "Kokkos::initialize();"
-                ]
-
-                # create temp for all args for lifetime 
-                gen_arg_casts(binding, (inst,) + args)
-
-                binding.append(f"return a0.{func_name}(")
-                vargs = []
-                for i, arg in enumerate(args):
-                    if isinstance(arg, char_ptr):
-                        vargs.append(f"a{i+1}.c_str()")
-                    else:
-                        vargs.append(f"a{i+1}")
-
-                binding.append(",".join(vargs) + ");}")
-                
-                gen_pybind_module(f, binding, name_hash, take_ownership)
-
-
-            compile_binding(name_hash)
-            global total_build_time
-            total_build_time += timer.seconds()
+    if release_gil is None:
+        release_gil = release_gil_default
 
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
+    args = adapt_args(args)
+    includes = get_arg_includes(includes, (inst,) + tuple(args))
+    tracer = get_tracer()
+    if tracer is not None:
+        return tracer.record(func_name, args, includes, inst)
+
+    key = (inst._cpp_name, func_name, tuple(map(_arg_key, args)), release_gil)
+    func = _dispatch_cache.get(key)
+    if func is None:
+        name_hash = get_hash(inst._cpp_name + func_name, None, args, None, release_gil)
+        body = f"return a0.{func_name}({gen_call_args(args, 1)});"
+        mod = load_binding(name_hash, includes, gen_params((inst,) + args), body, take_ownership, release_gil)
+
+        func = getattr(mod, name_hash)
+        _dispatch_cache[key] = func
 
     # func invocation
     args = [get_handle(arg) for arg in args]
-    res = getattr(sys.modules[mod_name], name_hash)(inst._handle, *args)
+    res = func(inst._handle, *args)
     return cast_return(res)
 
 
@@ -371,126 +922,222 @@ def generate_operator_binding(inst, args, op_type, includes):
     if inst._handle is None:
         raise TypeError("Attempted to call function on type object!")
 
+    includes = get_arg_includes(includes, (inst,) + tuple(args))
     name_hash = get_hash(inst._cpp_name + func_name, None, args, None)
-    mod_name = f"build.{name_hash}"
-    mod_path = f"build/{name_hash}.so"
-    if mod_name not in sys.modules:
-        try:
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
-        except (ImportError, ModuleNotFoundError):
-            timer.reset()
-            with open(f"build/{name_hash}.cpp", "w") as f:
-                for include in includes:
-                    f.write(f"#include <{include}>\n")
-               
-                binding = [
-                    f"auto {_FUNC_NAME}(pybind11::args args){{",
-                    # "Kokkos::initialize();"
-                ]
-
-                # create temp for all args for lifetime 
-                gen_arg_casts(binding, (inst,) + args)
-
-                if op_type is Operator.ADD:
-                    binding.append(f"return a0 + a1;")
-                elif op_type is Operator.SUB:
-                    binding.append(f"return a0 - a1;")
-                elif op_type is Operator.GET_ITEM:
-                    binding.append(f"return a0[a1];")
-                elif op_type is Operator.SET_ITEM:
-                    binding.append(f"a0[a1] = a2;")
-                elif op_type is Operator.CALL:
-                    vargs = []
-                    for i, arg in enumerate(args):
-                        if isinstance(arg, char_ptr):
-                            vargs.append(f"a{i+1}.c_str()")
-                        else:
-                            vargs.append(f"a{i+1}")
-
-                    binding.append(f"return a0({','.join(vargs)});")
-                elif op_type is Operator.DEREF:
-                    binding.append(f"return *a0;")
-                else:
-                    raise ValueError(f"Unknown Operator: ", op_type)
-                binding.append("}")
-
-                gen_pybind_module(f, binding, name_hash, False)
-
-
-            compile_binding(name_hash)
-            global total_build_time
-            total_build_time += timer.seconds()
+    if op_type is Operator.ADD:
+        body = "return a0 + a1;"
+    elif op_type is Operator.SUB:
+        body = "return a0 - a1;"
+    elif op_type is Operator.GET_ITEM:
+        body = "return a0[a1];"
+    elif op_type is Operator.SET_ITEM:
+        body = "a0[a1] = a2;"
+    elif op_type is Operator.CALL:
+        body = f"return a0({gen_call_args(args, 1)});"
+    elif op_type is Operator.DEREF:
+        body = "return *a0;"
+    else:
+        raise ValueError(f"Unknown Operator: ", op_type)
 
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
+    mod = load_binding(name_hash, includes, gen_params((inst,) + args), body, False)
+    return (mod, name_hash)
 
-    return (sys.modules[mod_name], name_hash)
 
+# resolved operator callable of inst, cached on its wrapper class
+def get_operator(inst, args, op_type, includes):
+    check_not_tracing(f"Operator {op_type.name} of {inst._cpp_name}")
+    if _pending_flush is not None:
+        _pending_flush()
 
-def call_func(func_name, namespace, args, includes, template_args, take_ownership):
-    # check binding and generate
-    generated_kernels.add(func_name)
+    key = (op_type, inst._cpp_name, tuple(map(_arg_key, args)))
+    func = inst._operators.get(key)
+    if func is None:
+        mod, name_hash = generate_operator_binding(inst, args, op_type, includes)
+        func = getattr(mod, name_hash)
+        inst._operators[key] = func
+    return func
 
-    name_hash = get_hash(func_name, namespace, args, template_args)
-    mod_name = f"build.{name_hash}"
-    mod_path = f"build/{name_hash}.so"
-    if mod_name not in sys.modules:
-        try:
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
-        except (ImportError, ModuleNotFoundError) as e:
-            timer.reset()
-            with open(f"build/{name_hash}.cpp", "w") as f:
-                for include in includes:
-                    f.write(f"#include <{include}>\n")
 
-                binding = [
-                    f"auto {_FUNC_NAME}(pybind11::args args){{",
-                    # "Kokkos::initialize();"
-                ]
+_NUMPY_HEADER = "pybind11/numpy.h"
 
-                # create temp for all args for lifetime 
-                gen_arg_casts(binding, args)
 
-                # explicit template args
-                binding.append(f"return {get_cpp_name(func_name, namespace, template_args)}(")
+# key of __getitem__/__setitem__ handled by gather/scatter
+def is_vector_index(key):
+    return type(key) is slice or type(key) is list or getattr(key, "ndim", 0) > 0
 
-                vargs = []
-                for i, arg in enumerate(args):
-                    if isinstance(arg, char_ptr):
-                        vargs.append(f"a{i}.c_str()")
-                    else:
-                        vargs.append(f"a{i}")
 
-                binding.append(",".join(vargs) + ");}")
+# index array of a slice/sequence key, bounds checked against inst.size()
+def get_indices(inst, key):
+    import numpy as np
 
-                gen_pybind_module(f, binding, name_hash, take_ownership)
+    n = inst.size() if hasattr(inst, "size") else None
+    if type(key) is slice:
+        if n is None:
+            raise TypeError(f"Slicing {inst._cpp_name} requires a size() method!")
+        return np.arange(*key.indices(n))
 
+    idx = np.ascontiguousarray(key)
+    if idx.size == 0:
+        idx = idx.astype(np.int64)
+    if idx.ndim != 1 or idx.dtype.kind not in "iu":
+        raise IndexError("Index arrays must be one dimensional integer arrays!")
 
-            compile_binding(name_hash)
-            global total_build_time
-            total_build_time += timer.seconds()
+    if idx.size != 0:
+        if n is None:
+            # without a size negative indices cannot be wrapped
+            if idx.min() < 0:
+                raise IndexError(f"Negative indices require a size() method of {inst._cpp_name}!")
+        elif idx.min() < -n or idx.max() >= n:
+            raise IndexError(f"Index out of range for {inst._cpp_name} of size {n}!")
+        elif idx.min() < 0:
+            idx = np.where(idx < 0, idx + n, idx)
+    return idx
 
-            import_module(mod_path, mod_name)
-            verify_return_registered(sys.modules[mod_name])
+
+def get_array_type(arr):
+    try:
+        return _numpy_cpp_types[arr.dtype.name]
+    except KeyError:
+        raise TypeError(f"Unsupported array dtype {arr.dtype}!")
+
+
+# one native loop per (container, index dtype, value dtype), cached like operators
+def get_index_operator(inst, op_type, idx, vals, includes):
+    if _pending_flush is not None:
+        _pending_flush()
+
+    key = (op_type, inst._cpp_name, idx.dtype, None if vals is None else vals.dtype)
+    func = inst._operators.get(key)
+    if func is None:
+        generated_kernels.add(op_type.value)
+
+        cpp_types = [get_array_type(idx)]
+        params = [f"{inst._cpp_name} & a0", f"pybind11::array_t<{cpp_types[0]}> a1"]
+        loop = "auto idx = a1.unchecked<1>(); for (pybind11::ssize_t i = 0; i < idx.shape(0); i++)"
+        if op_type is Operator.GATHER:
+            body = ("pybind11::array_t<wayout::element_t<decltype(a0)>> res(a1.size());"
+                    "auto out = res.mutable_unchecked<1>();"
+                    f"{loop} out(i) = a0[idx(i)];"
+                    "return res;")
+        elif op_type is Operator.SCATTER:
+            cpp_types.append(get_array_type(vals))
+            params.append(f"pybind11::array_t<{cpp_types[1]}> a2")
+            body = f"auto vals = a2.unchecked<1>(); {loop} a0[idx(i)] = vals(i);"
+        else:
+            raise ValueError(f"Unknown Operator: ", op_type)
+
+        name_hash = get_hash(f"{inst._cpp_name}{op_type.value}<{','.join(cpp_types)}>", None, (), None)
+        mod = load_binding(name_hash, includes + [_NUMPY_HEADER], params, body, False)
+        func = getattr(mod, name_hash)
+        inst._operators[key] = func
+    return func
+
+
+# inst[key] for a slice or index array, copied into a new numpy array
+def gather(inst, key, includes):
+    check_not_tracing(f"Indexing {inst._cpp_name}")
+    idx = get_indices(inst, key)
+    return get_index_operator(inst, Operator.GATHER, idx, None, includes)(inst._handle, idx)
+
+
+# inst[key] = val for a slice or index array, val is a scalar or matching array
+def scatter(inst, key, val, includes):
+    import numpy as np
+
+    check_not_tracing(f"Indexing {inst._cpp_name}")
+    idx = get_indices(inst, key)
+    # ascontiguousarray would turn scalars into 1-element arrays
+    vals = np.asarray(get_handle(val))
+    if vals.ndim == 0:
+        vals = np.full(idx.shape, vals)
+    elif vals.shape == idx.shape:
+        vals = np.ascontiguousarray(vals)
+    else:
+        raise ValueError(f"Cannot assign {vals.shape[0]} values to {idx.shape[0]} indices!")
+    get_index_operator(inst, Operator.SCATTER, idx, vals, includes)(inst._handle, idx, vals)
+
+
+# numpy array sharing the memory of inst (buffer protocol of its pybind class)
+def as_array(inst, dtype=None, copy=None):
+    import numpy as np
+
+    if inst._handle is None:
+        raise TypeError("Attempted to convert type object to array!")
+    try:
+        view = memoryview(inst._handle)
+    except TypeError:
+        raise TypeError(f"{inst._cpp_name} is not a contiguous container!")
+    if copy:
+        return np.array(view, dtype=dtype)
+    return np.asarray(view, dtype=dtype)
+
+
+def call_func(func_name, namespace, args, includes, template_args, take_ownership, release_gil=None, param_types=None, default_args=None):
+    if _pending_flush is not None:
+        _pending_flush()
+
+    # check binding and generate
+    generated_kernels.add(func_name)
+
+    if release_gil is None:
+        release_gil = release_gil_default
+
+    args = adapt_args(args, param_types.get(len(args), ()) if param_types else ())
+    includes = get_arg_includes(includes, args)
+    tracer = get_tracer()
+    if tracer is not None:
+        return tracer.record(get_cpp_name(func_name, namespace, template_args), args, includes)
+
+    if default_args:
+        args = fill_default_args(args, default_args)
+    if param_types:
+        args = canonicalize_args(args, param_types)
+    # fast path: signature already resolved in this process
+    key = (func_name, namespace, _template_key(template_args), tuple(map(_arg_key, args)), release_gil)
+    func = _dispatch_cache.get(key)
+    if func is None:
+        name_hash = get_hash(func_name, namespace, args, template_args, release_gil)
+        # explicit template args
+        qualified_name = get_cpp_name(func_name, namespace, template_args)
+        body = f"return {qualified_name}({gen_call_args(args)});"
+
+        # ptr and reference parameters accept the same python object, so such
+        # signatures cannot be told apart by overload resolution, neither can
+        # scalars of numpy width (e.g. a float overload takes python floats
+        # before a later double one would)
+        if aggregate_overloads and not any(isinstance(arg, ptr) or type(arg) in _numpy_scalar_types for arg in args):
+            # same python arguments would match both variants, keep them apart
+            func_hash = "o_" + hashlib.sha1(qualified_name.encode('utf-8')).hexdigest()
+            if release_gil:
+                func_hash += _NOGIL_SUFFIX
+            mod = load_overload(func_hash, name_hash, includes, gen_params(args), body, take_ownership, release_gil)
+            func = getattr(mod, _FUNC_NAME)
+        else:
+            mod = load_binding(name_hash, includes, gen_params(args), body, take_ownership, release_gil)
+            func = getattr(mod, name_hash)
+        _dispatch_cache[key] = func
 
     # func invocation
     args = [get_handle(arg) for arg in args]
-    res = getattr(sys.modules[mod_name], name_hash)(*args)
+    res = func(*args)
     return cast_return(res)
 
 
 # register manually written bindings
 # assumes all binding names are of the format <class>_<t1>_<t2>_...
 _custom_types = {}
+# pybind type -> wrapper factory of returned objects (None if returned as is)
+_return_casts = {}
 def register_manual_wrapper(wrapper_cls, cls_name):
     assert hasattr(wrapper_cls, "_handle")
     assert hasattr(wrapper_cls, "_cpp_name")
     assert hasattr(wrapper_cls, "_from_handle")
     _custom_types[cls_name] = wrapper_cls._from_handle
+    # drop factories resolved before this wrapper existed
+    _return_casts.clear()
 
-def cast_return(res):
+
+def get_return_cast(res):
     if hasattr(res, "_cpp_type"):
         t = res._cpp_type
         end = t.find("<")
@@ -499,14 +1146,24 @@ def cast_return(res):
         begin = t.rfind("::")
         if begin != -1:
             t=t[begin+2:]
-        return getattr(sys.modules["kernels"], t)(_handle=res)
+        wrapper_cls = getattr(sys.modules["kernels"], t)
+        cpp_type = res._cpp_type
+        return lambda res: wrap_handle(wrapper_cls, res, cpp_type)
 
     #TODO: find more flexible mechanism
     t = type(res).__name__.split("_")[0]
-    if t in _custom_types:
-        return _custom_types[t](res)
-    else:
+    return _custom_types.get(t)
+
+
+def cast_return(res):
+    try:
+        factory = _return_casts[type(res)]
+    except KeyError:
+        factory = _return_casts[type(res)] = get_return_cast(res)
+
+    if factory is None:
         return res
+    return factory(res)
 
 def print_build_info():
     print(f"dynamic_compile_time=[{total_build_time}]")
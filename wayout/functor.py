@@ -0,0 +1,157 @@
+"""
+functor.py
+
+functors declared from a cpp expression, compiled into a class registered like
+any other wrapper so instances can be passed to algorithms taking one
+
+    saxpy = wayout.functor("double a", "(x, y) -> a * x + y")
+    transform(X.begin(), X.end(), Y.begin(), Y.begin(), saxpy(2.0))
+
+members are initialized in declaration order by the constructor, untyped
+parameters of the expression are deduced at each call site, a body in braces
+(e.g. "(x) -> { auto t = x * x; return t + 1; }") is used as is
+"""
+
+import hashlib
+import os
+import re
+import sys
+
+from .dynamic import Operator, call_constructor, cast_return, get_handle, get_operator, runtime_headers
+from .static import CLASSES_HEADER
+
+_expr_patt = re.compile(r"^\s*\((.*?)\)\s*->\s*(.+?)\s*$", re.DOTALL)
+
+# functor classes keyed by (members, expr, includes)
+_functors = {}
+
+
+class Functor:
+    """wrapper of a functor declared with functor()"""
+    __slots__ = ("_handle", "_cpp_name")
+    # resolved operator bindings of all functors (see get_operator)
+    _operators = {}
+    _cpp_header = None
+    _includes = []
+
+    def __init__(self, _handle=None):
+        self._handle = _handle
+        self._cpp_name = self._cpp_header[:-len(".hpp")]
+
+    def __call__(self, *args):
+        return call_constructor(self, args, self._includes)
+
+    def __cpp_call__(self, *args):
+        func = get_operator(self, args, Operator.CALL, self._includes)
+        args = [get_handle(arg) for arg in args]
+        res = func(self._handle, *args)
+        return cast_return(res)
+
+
+# split comma separated declarations, ignoring commas of template arguments
+def _split_decls(decls):
+    if not isinstance(decls, str):
+        return [d.strip() for d in decls if d.strip()]
+
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(decls):
+        if c in "<([":
+            depth += 1
+        elif c in ">)]":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(decls[start:i])
+            start = i + 1
+    parts.append(decls[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+# (type, name) of a declaration, the name is the last word
+def _split_decl(decl):
+    match = re.match(r"^(.*?)\s*\b(\w+)$", decl)
+    if match is None:
+        raise ValueError(f"Invalid declaration \"{decl}\"!")
+    return match.group(1), match.group(2)
+
+
+# bindings include the functor's includes before this header (see
+# dynamic.get_arg_includes), headers without include guards stay single
+def gen_functor_header(name, members, params, expr):
+    lines = ["#pragma once", f"#include \"{CLASSES_HEADER}\""]
+
+    template_args = []
+    cpp_params = []
+    for i, param in enumerate(params):
+        typename, param_name = _split_decl(param)
+        if not typename:
+            # untyped parameter, deduced like a generic lambda
+            typename = f"T{i}"
+            template_args.append(f"class {typename}")
+            typename = f"const {typename} &"
+        cpp_params.append(f"{typename} {param_name}")
+
+    lines.append(f"struct {name} {{")
+    lines.extend(f"  {member};" for member in members)
+    if template_args:
+        lines.append(f"  template <{','.join(template_args)}>")
+    body = expr if expr.startswith("{") else f"{{ return {expr}; }}"
+    lines.append(f"  WAYOUT_HOST_DEVICE auto operator()({','.join(cpp_params)}) const {body}")
+    lines.append("};")
+
+    lines.extend([
+        "template <class T_>",
+        f"void generate_{name}(pybind11::module &_mod, const char *name, const char *cpp_type) {{",
+        "  auto _class = wayout::make_class<T_>(_mod, name);",
+        "  _class.def_property_readonly_static(\"_cpp_type\", [cpp_type](const pybind11::object&) { return cpp_type; });",
+    ])
+    lines.extend(f"  _class.def_readwrite(\"{_split_decl(m)[1]}\", &T_::{_split_decl(m)[1]});" for m in members)
+    lines.append("}")
+
+    # constructed by a binding returning it, which registers the class
+    lines.extend([
+        "namespace wayout {",
+        "template <>",
+        f"struct registrar<{name}> : std::true_type {{",
+        "  static void generate(pybind11::module &mod, const char *name, const char *cpp_type) {",
+        f"    generate_{name}<{name}>(mod, name, cpp_type);",
+        "  }",
+        "};",
+        "}",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+# includes of the generated wrappers
+def get_default_includes():
+    return list(getattr(sys.modules.get("kernels"), "_includes", []))
+
+
+def functor(members, expr, includes=None):
+    """functor type with the given members (e.g. "double a, int n") whose call
+    operator evaluates expr (e.g. "(x, y) -> a * x + y"), includes default to
+    the ones of the generated wrappers"""
+    includes = get_default_includes() if includes is None else list(includes)
+    members = _split_decls(members)
+
+    key = (tuple(members), expr, tuple(includes))
+    cls = _functors.get(key)
+    if cls is None:
+        match = _expr_patt.match(expr)
+        if match is None:
+            raise ValueError(f"Invalid functor expression \"{expr}\", expected \"(params) -> expr\"!")
+        params, body = _split_decls(match.group(1)), match.group(2)
+
+        source = ",".join(includes) + ";".join(members) + expr
+        name = "functor_" + hashlib.sha1(source.encode('utf-8')).hexdigest()
+        header = gen_functor_header(name, members, params, body)
+
+        path = f"build/{name}.hpp"
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(header)
+        runtime_headers.add(f"{name}.hpp")
+
+        cls = type(name, (Functor,), {"__slots__": (), "_cpp_header": f"{name}.hpp", "_includes": includes})
+        _functors[key] = cls
+
+    return cls()
@@ -0,0 +1,192 @@
+"""
+fusion.py
+
+lazy BLAS-1 layer over the generated KokkosBlas wrappers, consecutive
+axpy/axpby/scal calls on rank 1 views are deferred and run together with the
+next dot/nrm2 in a single Kokkos kernel
+
+    blas = wayout.fusion.lazy(KokkosBlas)
+    blas.axpy(alpha, p, x)
+    blas.axpy(-alpha, Ap, r)
+    r_dot = blas.dot(r, r)  # float, computed in one kernel with both axpys
+    beta = r_dot / r_old_dot
+
+pending operations are flushed before any other binding call, or explicitly
+with flush() before touching view memory from python
+"""
+
+import hashlib
+import math
+
+from . import dynamic
+from .dynamic import gen_params, get_handle, load_binding
+
+
+class _Result:
+    """value of a reduction, set when its group runs"""
+    __slots__ = ("value",)
+
+
+# per element statement of each operation, {v<n>} are views and {s<n>} scalars
+_ELEMENTWISE = {
+    "axpy": "{v1}(i) += {s0} * {v0}(i);",
+    "axpby": "{v1}(i) = {s1} * {v1}(i) + {s0} * {v0}(i);",
+    "scal": "{v0}(i) = {s0} * {v1}(i);",
+}
+_REDUCTIONS = {
+    "dot": "sum += {v0}(i) * {v1}(i);",
+    "nrm2": "sum += {v0}(i) * {v0}(i);",
+}
+
+# fused kernel callables keyed by group structure
+_kernels = {}
+
+# blas layers with deferred operations
+_pending = []
+
+
+class LazyBlas:
+    def __init__(self, module):
+        self._module = module
+        # generated kernels module of the namespace, holds its includes
+        self._includes = list(getattr(getattr(module, "kernels", module), "_includes", []))
+        if "Kokkos_Core.hpp" not in self._includes:
+            self._includes.append("Kokkos_Core.hpp")
+        # (name, views, scalars, result)
+        self._ops = []
+
+    def _defer(self, name, views, scalars, result=None):
+        if not all(_is_vector(v) for v in views) or len({len(v) for v in views}) != 1:
+            # not fusible, run eagerly through the wrapper
+            flush()
+            return getattr(self._module, name)(*_eager_args(name, views, scalars))
+
+        if self._ops and len(views[0]) != len(self._ops[0][1][0]):
+            # a fused kernel spans one extent, the pending group runs first
+            flush()
+
+        if not self._ops:
+            _pending.append(self)
+            dynamic._pending_flush = flush
+        self._ops.append((name, views, [float(s) for s in scalars], result))
+        if result is not None:
+            # a reduction ends its group, nothing is gained by deferring it
+            flush()
+            return result.value
+
+    def axpy(self, a, x, y):
+        """y = y + a*x"""
+        return self._defer("axpy", [x, y], [a])
+
+    def axpby(self, a, x, b, y):
+        """y = b*y + a*x"""
+        return self._defer("axpby", [x, y], [a, b])
+
+    def scal(self, r, a, x):
+        """r = a*x"""
+        return self._defer("scal", [r, x], [a])
+
+    def dot(self, x, y):
+        """sum of x*y"""
+        return self._defer("dot", [x, y], [], _Result())
+
+    def nrm2(self, x):
+        """euclidean norm of x"""
+        return self._defer("nrm2", [x], [], _Result())
+
+    def flush(self):
+        ops, self._ops = self._ops, []
+        group = []
+        for op in ops:
+            group.append(op)
+            if op[0] in _REDUCTIONS:
+                self._run(group)
+                group = []
+        if group:
+            self._run(group)
+
+    def _run(self, group):
+        views, scalars = [], []
+        view_index = {}
+        structure = []
+        for name, op_views, op_scalars, _ in group:
+            indices = []
+            for v in op_views:
+                if id(v) not in view_index:
+                    view_index[id(v)] = len(views)
+                    views.append(v)
+                indices.append(view_index[id(v)])
+            structure.append((name, tuple(indices), tuple(range(len(scalars), len(scalars) + len(op_scalars)))))
+            scalars.extend(op_scalars)
+
+        key = (tuple(structure), tuple(v._cpp_name for v in views))
+        func = _kernels.get(key)
+        if func is None:
+            func = _kernels[key] = self._compile(structure, views, len(scalars))
+
+        res = func(*[get_handle(v) for v in views], *scalars)
+
+        name, _, _, result = group[-1]
+        if result is not None:
+            result.value = math.sqrt(res) if name == "nrm2" else res
+
+    def _compile(self, structure, views, num_scalars):
+        params = gen_params(views)
+        params.extend(f"double s{i}" for i in range(num_scalars))
+
+        statements = []
+        for name, view_indices, scalar_indices in structure:
+            names = {f"v{n}": f"a{i}" for n, i in enumerate(view_indices)}
+            names.update({f"s{n}": f"s{i}" for n, i in enumerate(scalar_indices)})
+            statements.append({**_ELEMENTWISE, **_REDUCTIONS}[name].format(**names))
+
+        extent = "a0.extent(0)"
+        # explicit return types, nvcc rejects a KOKKOS_LAMBDA inside a function
+        # with a deduced one
+        return_type = "void"
+        if structure[-1][0] in _REDUCTIONS:
+            # explicit value type, reductions may not deduce it from the lambda
+            return_type = f"{views[0]._cpp_name}::non_const_value_type"
+            body = (f"using value_type = {return_type};"
+                    "value_type result = 0;"
+                    f"Kokkos::parallel_reduce(\"wayout_fused\", {extent}, KOKKOS_LAMBDA(const int i, value_type &sum) {{"
+                    f"{''.join(statements)}}}, result);"
+                    "return result;")
+        else:
+            body = (f"Kokkos::parallel_for(\"wayout_fused\", {extent}, KOKKOS_LAMBDA(const int i) {{"
+                    f"{''.join(statements)}}});")
+
+        source = ",".join(self._includes) + ",".join(params) + return_type + body
+        name_hash = "f_" + hashlib.sha1(source.encode('utf-8')).hexdigest()
+        dynamic.generated_kernels.add("fused")
+        mod = load_binding(name_hash, self._includes, params, body, False, return_type=return_type)
+        return getattr(mod, name_hash)
+
+
+# rank 1 views, other arguments go to the eager wrappers
+def _is_vector(v):
+    return hasattr(v, "_cpp_name") and hasattr(v, "rank") and v.rank() == 1
+
+
+def _eager_args(name, views, scalars):
+    if name == "axpy":
+        return [scalars[0], views[0], views[1]]
+    elif name == "axpby":
+        return [scalars[0], views[0], scalars[1], views[1]]
+    elif name == "scal":
+        return [views[0], scalars[0], views[1]]
+    return views
+
+
+def flush():
+    """run all deferred operations"""
+    global _pending
+    dynamic._pending_flush = None
+    pending, _pending = _pending, []
+    for blas in pending:
+        blas.flush()
+
+
+def lazy(module):
+    """lazy BLAS-1 layer over a generated KokkosBlas namespace module"""
+    return LazyBlas(module)
@@ -0,0 +1,108 @@
+"""
+prebuild.py
+
+compiles the bindings recorded in the manifest of a build directory (see
+dynamic.record_manifest) in parallel, so later runs load them without
+compiling
+
+    WAYOUT_MANIFEST=1 python cgsolve.py     # once, records the manifest
+    python -m wayout.prebuild . -j 32       # before each job on a clean build
+
+with --unity, the bindings are compiled in batches sharing one translation unit
+each, so common headers are parsed once per batch instead of once per binding,
+the bindings of a failing batch are compiled one by one
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from . import dynamic
+
+
+# build directory of path, either the directory itself or its build/
+def find_build_dir(path):
+    for build_dir in (path, os.path.join(path, "build")):
+        if os.path.exists(os.path.join(build_dir, dynamic.MANIFEST)):
+            return os.path.abspath(build_dir)
+    raise FileNotFoundError(f"No {dynamic.MANIFEST} in {path} or {path}/build!")
+
+
+# manifest entries keyed by hash, later entries win
+def read_manifest(build_dir):
+    entries = {}
+    with open(os.path.join(build_dir, dynamic.MANIFEST)) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry["hash"]] = entry
+    return entries
+
+
+# headers written at runtime by the recording process (e.g. of functors)
+def restore_headers(entry):
+    for name, text in entry.get("headers", {}).items():
+        path = f"build/{name}"
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(text)
+
+
+def prebuild(path, workers=None, force=False, unity=None):
+    """compile all manifest entries of the build directory at path missing a
+    module (all with force), in batches of unity bindings if set (0 splits
+    them evenly over the workers), returns the hashes that failed"""
+    build_dir = find_build_dir(path)
+    entries = read_manifest(build_dir)
+
+    # bindings resolve build/ relative to the working directory
+    if os.path.basename(build_dir) != "build":
+        raise ValueError(f"Build directory {build_dir} has to be named build!")
+    os.chdir(os.path.dirname(build_dir))
+
+    if workers:
+        dynamic.set_compile_workers(workers)
+    dynamic.record_manifest = False
+
+    pending = [name_hash for name_hash in entries if force or not os.path.exists(f"build/{name_hash}.so")]
+    for name_hash in pending:
+        restore_headers(entries[name_hash])
+
+    futures = {}
+    if unity is not None and pending:
+        size = unity or -(-len(pending) // dynamic.compile_workers)
+        for i in range(0, len(pending), size):
+            batch = {name_hash: entries[name_hash]["source"] for name_hash in pending[i:i + size]}
+            futures.update(dynamic.compile_unity_async(batch))
+    else:
+        for name_hash in pending:
+            futures[name_hash] = dynamic.compile_binding_async(
+                    name_hash, dynamic.write_source(name_hash, entries[name_hash]["source"]))
+
+    failed = []
+    for name_hash, future in futures.items():
+        if future.exception() is not None:
+            failed.append(name_hash)
+
+    print(f"prebuilt {len(futures) - len(failed)} of {len(entries)} bindings"
+          f" ({len(entries) - len(futures)} up to date, {len(failed)} failed)")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m wayout.prebuild",
+            description="compile the bindings recorded in a build directory manifest")
+    parser.add_argument("dir", help="build directory or its parent")
+    parser.add_argument("-j", "--jobs", type=int, help="parallel compilations (default: number of cores)")
+    parser.add_argument("--force", action="store_true", help="rebuild bindings that are already built")
+    parser.add_argument("--unity", type=int, nargs="?", const=0,
+            help="compile bindings in batches of UNITY per translation unit (default: one batch per job)")
+    args = parser.parse_args()
+
+    failed = prebuild(args.dir, args.jobs, args.force, args.unity)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
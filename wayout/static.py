@@ -16,7 +16,7 @@ import subprocess
 import clang.cindex as cindex
 
 namespace = None
-def traverse_ast(outputs, path, node, indent, functions, enums, build_dir, headers):
+def traverse_ast(outputs, path, node, indent, functions, enums, build_dir, header_includes, classes):
     global namespace
     temp_namespace = namespace 
 
@@ -42,7 +42,9 @@ def traverse_ast(outputs, path, node, indent, functions, enums, build_dir, heade
         namespace_str = f"\"{namespace}\"" if namespace else None
         outputs[namespace] = [
                 '# Translation unit:'+path,
-                f"_namespace = {namespace_str}"]
+                f"_namespace = {namespace_str}",
+                "_param_types = {}",
+                "_default_args = {}"]
 
 
     if node.kind == cindex.CursorKind.CLASS_TEMPLATE:
@@ -51,7 +53,7 @@ def traverse_ast(outputs, path, node, indent, functions, enums, build_dir, heade
             return
 
         output = outputs[namespace]
-        generate_class_header(node, build_dir, headers)
+        generate_class_header(node, build_dir, header_includes, classes)
         generate_class(output, node)
         output.append("")
         return
@@ -77,7 +79,7 @@ def traverse_ast(outputs, path, node, indent, functions, enums, build_dir, heade
 
     # Recurse for children of this node
     for c in node.get_children():
-        traverse_ast(outputs, path, c, indent+1, functions, enums, build_dir, headers)
+        traverse_ast(outputs, path, c, indent+1, functions, enums, build_dir, header_includes, classes)
 
     namespace = temp_namespace 
 
@@ -123,23 +125,29 @@ def get_params(node, func_node):
     return params
 
 
-# generate guarded invocation to potentially register return types
-def gen_guarded_invocation(output, tab_lvl, invocation_str):
-    lines = [
-        "try:",
-        f"\tres = {invocation_str}",
-        "except TypeError as e:",
-        "\tret_type = re.search(_type_err_patt, str(e)).group(1)",
-        "\tregister_class(None, None, None, qualified_name=ret_type)",
-        f"\tres = {invocation_str}",
-    ]
+# qualified name of a class template if a registrar can be specialized for it
+# (only type parameters, declared at namespace scope), None otherwise
+def get_registrar_name(node):
+    for c in node.get_children():
+        if c.kind == cindex.CursorKind.TEMPLATE_NON_TYPE_PARAMETER or \
+                c.kind == cindex.CursorKind.TEMPLATE_TEMPLATE_PARAMETER:
+            return None
+
+    parts = [node.spelling]
+    parent = node.semantic_parent
+    while parent.kind != cindex.CursorKind.TRANSLATION_UNIT:
+        if parent.kind != cindex.CursorKind.NAMESPACE or parent.spelling == "":
+            return None
+        parts.append(parent.spelling)
+        parent = parent.semantic_parent
+    return "::".join(reversed(parts))
 
-    output.extend(["\t"*tab_lvl + line for line in lines])
 
+def generate_class_header(node, build_dir, header_includes, classes):
+    header = list(header_includes)
 
-def generate_class_header(node, build_dir, headers):
-    header = []
-    header.extend([f"#include <{f}>" for f in headers])
+    with open(f"{build_dir}/{node.spelling}.hpp", "w") as f:
+        f.write("\n".join(header))
 
     template_args = ["class T_"]
     # provide access to template args
@@ -147,13 +155,14 @@ def generate_class_header(node, build_dir, headers):
     #     if c.kind == cindex.CursorKind.TEMPLATE_TYPE_PARAMETER:
     #         template_args.append("class " + c.spelling)
 
-    header.extend([
+    body = [
         f"template <{','.join(template_args)}>",
-        "void generate_class(pybind11::module &_mod, const char *name, const char *cpp_type) {",
-        "   pybind11::class_<T_> _class(_mod, name);",
+        f"void generate_{node.spelling}(pybind11::module &_mod, const char *name, const char *cpp_type) {{",
+        "   auto _class = wayout::make_class<T_>(_mod, name);",
         "   _class.def_property_readonly_static(\"_cpp_type\", [cpp_type](const pybind11::object&) { return cpp_type; });"
-    ])
+    ]
     
+    fields = []
     for c in node.get_children(): 
         # public class variable
         if c.kind == cindex.CursorKind.FIELD_DECL and \
@@ -164,11 +173,44 @@ def generate_class_header(node, build_dir, headers):
             def_func = "readwrite" 
             if c.type.is_const_qualified():
                 def_func = "readonly"
-            header.append(f"  _class.def_{def_func}(\"{c.spelling}\", &T_::{c.spelling});")
-    header.append("}");
+            body.append(f"  _class.def_{def_func}(\"{c.spelling}\", &T_::{c.spelling});")
+            fields.append(c.spelling)
+
+    # field types still needing registration (see verify_field_registered)
+    body.append("  _class.def_static(\"_field_type\", [](const std::string &field) -> pybind11::object {")
+    for field in fields:
+        body.append(f"    if (field == \"{field}\") return wayout::unregistered_type<decltype(T_::{field})>();")
+    body.append("    return pybind11::none();")
+    body.append("  });")
+    body.append("}");
+
+    # let bindings returning this class register it themselves
+    registrar_name = get_registrar_name(node)
+    if registrar_name is not None:
+        body.extend([
+            "namespace wayout {",
+            "template <class... A>",
+            f"struct registrar<{registrar_name}<A...>> : std::true_type {{",
+            "  static void generate(pybind11::module &mod, const char *name, const char *cpp_type) {",
+            f"    generate_{node.spelling}<{registrar_name}<A...>>(mod, name, cpp_type);",
+            "  }",
+            "};",
+            "}",
+        ])
 
-    with open(f"{build_dir}/{node.spelling}.hpp", "w") as f:
-        f.write("\n".join(header))
+    # class headers share a name, last definition wins
+    classes[node.spelling] = body
+
+
+# registration code of all classes, included by every binding
+CLASSES_HEADER = "wayout_classes.hpp"
+def generate_classes_header(build_dir, classes):
+    lines = ["#pragma once", "#include \"wayout.hpp\""]
+    for body in classes.values():
+        lines.extend(body)
+
+    with open(f"{build_dir}/{CLASSES_HEADER}", "w") as f:
+        f.write("\n".join(lines))
 
 
 # get only class name from templated name (potentitally typedef)
@@ -253,10 +295,18 @@ def generate_class(output, node):
         output.append(f"\t\"\"\"{node.brief_comment}\"\"\"")
 
     # class body
+    # instance state lives in slots, declared once at the root of the hierarchy
+    if len(parents) != 0:
+        output.append(f"\t__slots__ = () if hasattr({parents[0]}, \"_handle\") else (\"_handle\", \"_cpp_name\")")
+    else:
+        output.append("\t__slots__ = (\"_handle\", \"_cpp_name\")")
+    # resolved operator bindings of all instantiations (see get_operator)
+    output.append("\t_operators = {}")
+
     # register class in init 
     output.extend(["\tdef __init__(self, *template_args, _handle=None):",
         "\t\tself._handle = _handle",
-        f"\t\tself._cpp_name = _handle._cpp_type if _handle else register_class(\"{node.spelling}\", _namespace, template_args)"
+        f"\t\tself._cpp_name = _handle._cpp_type if _handle else get_cpp_name(\"{node.spelling}\", _namespace, template_args)"
         ""
     ])
 
@@ -266,6 +316,12 @@ def generate_class(output, node):
         ""
     ])
 
+    # zero-copy numpy view of contiguous containers
+    output.extend(["\tdef __array__(self, dtype=None, copy=None):",
+        f"\t\treturn as_array(self, dtype, copy)",
+        ""
+    ])
+
     functions = []
 
     for c in node.get_children(): 
@@ -302,48 +358,52 @@ def generate_class(output, node):
                 if child_name == "operator+":
                     output.append(f"\tdef __add__(self, other):")
                     output.extend([
-                        f"\t\tmod, name = generate_operator_binding(self, (other,), Operator.ADD, _includes)",
-                        "\t\tres = getattr(mod, name)(self._handle, get_handle(other))",
+                        f"\t\tfunc = get_operator(self, (other,), Operator.ADD, _includes)",
+                        "\t\tres = func(self._handle, get_handle(other))",
                         "\t\treturn cast_return(res)"
                     ])
                 # subtraction operator
                 elif child_name == "operator-":
                     output.append(f"\tdef __sub__(self, other):")
                     output.extend([
-                        f"\t\tmod, name = generate_operator_binding(self, (other,), Operator.SUB, _includes)",
-                        "\t\tres = getattr(mod, name)(self._handle, get_handle(other))",
+                        f"\t\tfunc = get_operator(self, (other,), Operator.SUB, _includes)",
+                        "\t\tres = func(self._handle, get_handle(other))",
                         "\t\treturn cast_return(res)"
                     ])
                 # indexing operator
                 elif child_name == "operator[]":
                     output.append(f"\tdef __getitem__(self, key):")
                     output.extend([
-                        f"\t\tmod, name = generate_operator_binding(self, (key,), Operator.GET_ITEM, _includes)",
-                        "\t\tres = getattr(mod, name)(self._handle, key)",
+                        "\t\tif is_vector_index(key):",
+                        "\t\t\treturn gather(self, key, _includes)",
+                        f"\t\tfunc = get_operator(self, (key,), Operator.GET_ITEM, _includes)",
+                        "\t\tres = func(self._handle, key)",
                         "\t\treturn cast_return(res)"
                     ])
 
                     output.append(f"\tdef __setitem__(self, key, val):")
                     output.extend([
-                        f"\t\tmod, name = generate_operator_binding(self, (key, val), Operator.SET_ITEM, _includes)",
-                        "\t\tres = getattr(mod, name)(self._handle, key, val)",
+                        "\t\tif is_vector_index(key):",
+                        "\t\t\treturn scatter(self, key, val, _includes)",
+                        f"\t\tfunc = get_operator(self, (key, val), Operator.SET_ITEM, _includes)",
+                        "\t\tres = func(self._handle, key, val)",
                         "\t\treturn cast_return(res)"
                     ])
                 # call operator 
                 elif child_name == "operator()":
                     output.append(f"\tdef __cpp_call__(self, *args):")
                     output.extend([
-                        f"\t\tmod, name = generate_operator_binding(self, args, Operator.CALL, _includes)",
+                        f"\t\tfunc = get_operator(self, args, Operator.CALL, _includes)",
                         f"\t\targs = [get_handle(arg) for arg in args]",
-                        "\t\tres = getattr(mod, name)(self._handle, *args)",
+                        "\t\tres = func(self._handle, *args)",
                         "\t\treturn cast_return(res)"
                     ])
                 # deref operator 
                 elif child_name == "operator*":
                     output.append(f"\tdef __deref__(self):")
                     output.extend([
-                        f"\t\tmod, name = generate_operator_binding(self, (), Operator.DEREF, _includes)",
-                        "\t\tres = getattr(mod, name)(self._handle)",
+                        f"\t\tfunc = get_operator(self, (), Operator.DEREF, _includes)",
+                        "\t\tres = func(self._handle)",
                         "\t\treturn cast_return(res)"
                     ])
 
@@ -357,13 +417,13 @@ def generate_class(output, node):
                     else:
                         params.append(f"{param.spelling}")
 
-            output.append(f"\tdef {child_name}(self, *args, take_ownership=False):")
+            output.append(f"\tdef {child_name}(self, *args, take_ownership=False, release_gil=None):")
             if c.raw_comment:
                 comment = '\t\t'.join(c.raw_comment.splitlines(True))
                 output.append(f"\t\t\"\"\"{comment}\"\"\"")
 
             output.append(
-                f"\t\treturn call_class_func(self, \"{child_name}\", args, _includes, take_ownership)"
+                f"\t\treturn call_class_func(self, \"{child_name}\", args, _includes, take_ownership, release_gil)"
             )
 
         # public class variable
@@ -378,8 +438,10 @@ def generate_class(output, node):
                 comment = '\t\t'.join(c.raw_comment.splitlines(True))
                 output.append(f"\t\t\"\"\"{comment}\"\"\"")
 
-            gen_guarded_invocation(output, 2, f"self._handle.{child_name}")
-            output.append("\t\treturn cast_return(res)")
+            output.extend([
+                f"\t\tverify_field_registered(self._handle, \"{child_name}\")",
+                f"\t\treturn cast_return(self._handle.{child_name})",
+            ])
 
         # typedefs
         elif c.kind == cindex.CursorKind.TYPEDEF_DECL:
@@ -398,6 +460,140 @@ def generate_class(output, node):
         output.append("\ttype = iterator_adaptor")
 
 
+_float_kinds = {cindex.TypeKind.FLOAT, cindex.TypeKind.DOUBLE, cindex.TypeKind.LONGDOUBLE}
+_int_kinds = {cindex.TypeKind.SHORT, cindex.TypeKind.INT, cindex.TypeKind.LONG, cindex.TypeKind.LONGLONG,
+        cindex.TypeKind.USHORT, cindex.TypeKind.UINT, cindex.TypeKind.ULONG, cindex.TypeKind.ULONGLONG}
+
+# concrete Kokkos::View in host memory, numpy arrays may be passed for it
+def is_host_view(p_type):
+    if p_type.kind == cindex.TypeKind.LVALUEREFERENCE:
+        p_type = p_type.get_pointee()
+    spelling = p_type.spelling
+    return re.match(r"^(const )?Kokkos::View<", spelling) is not None and \
+            re.search(r"\bKokkos::HostSpace\b", spelling) is not None
+
+
+# python type scalar arguments are coerced to for each parameter ("HostView"
+# for host space views, "None" for other classes and template dependent
+# types, whose deduced type is the argument's)
+def get_param_casts(node):
+    casts = []
+    for c in node.get_children():
+        if c.kind == cindex.CursorKind.PARM_DECL:
+            p_type = c.type.get_canonical()
+            # const references bind like values
+            if p_type.kind == cindex.TypeKind.LVALUEREFERENCE and \
+                    p_type.get_pointee().is_const_qualified():
+                p_type = p_type.get_pointee()
+
+            if p_type.kind == cindex.TypeKind.BOOL:
+                casts.append("bool")
+            elif p_type.kind in _float_kinds:
+                casts.append("float")
+            elif p_type.kind in _int_kinds:
+                casts.append("int")
+            elif is_host_view(p_type):
+                casts.append("HostView")
+            else:
+                casts.append("None")
+    return casts
+
+
+# python value of a literal default argument of a scalar parameter, "" if the
+# default is not a plain literal (or the parameter not a concrete scalar) and
+# None if the parameter has no default
+def get_default_arg(param, cast):
+    # expressions also size array parameters, only an initializer is a default
+    tokens = [t.spelling for t in param.get_tokens()]
+    if "=" not in tokens or not any(c.kind.is_expression() for c in param.get_children()):
+        return None
+    if cast == "None":
+        return ""
+    literal = "".join(tokens[tokens.index("=")+1:])
+
+    if literal in ("true", "false"):
+        value = literal == "true"
+    else:
+        literal = literal.replace("'", "")
+        try:
+            int_match = re.fullmatch(r"([+-]?)(0[xX][0-9a-fA-F]+|0[bB][01]+|\d+)[uUlL]*", literal)
+            if int_match:
+                sign, digits = int_match.groups()
+                # a leading zero makes a cpp literal octal
+                if re.fullmatch(r"0\d+", digits):
+                    digits = "0o" + digits[1:]
+                value = int(sign + digits, 0)
+            else:
+                value = float(literal.rstrip("lLfF"))
+        except ValueError:
+            return ""
+
+    value = {"bool": bool, "float": float, "int": int}[cast](value)
+    # python ints bind to a cpp int, wider defaults (e.g. of a size_t) are
+    # left to the callee
+    if cast == "int" and not -2**31 <= value < 2**31:
+        return ""
+    return repr(value)
+
+
+# (parameter casts, default args) of each distinct overload
+def get_signatures(nodes):
+    signatures = set()
+    for node in nodes:
+        params = [c for c in node.get_children() if c.kind == cindex.CursorKind.PARM_DECL]
+        casts = tuple(get_param_casts(node))
+        signatures.add((casts, tuple(get_default_arg(p, cast) for p, cast in zip(params, casts))))
+    return signatures
+
+
+# overloads that can be called with arity arguments
+def get_candidates(signatures, arity):
+    candidates = []
+    for casts, defaults in signatures:
+        required = next((i for i, d in enumerate(defaults) if d is not None), len(defaults))
+        if required <= arity <= len(defaults):
+            candidates.append((casts, defaults))
+    return candidates
+
+
+def get_max_arity(signatures):
+    return max((len(casts) for casts, _ in signatures), default=0)
+
+
+# arity -> parameter casts, kept only where all overloads accepting that many
+# arguments agree
+def get_param_types(signatures):
+    param_types = []
+    for arity in range(1, get_max_arity(signatures) + 1):
+        prefixes = {casts[:arity] for casts, _ in get_candidates(signatures, arity)}
+        if len(prefixes) == 1:
+            casts = prefixes.pop()
+            if any(cast != "None" for cast in casts):
+                trailing = "," if len(casts) == 1 else ""
+                param_types.append(f"{arity}: ({', '.join(casts)}{trailing})")
+    return param_types
+
+
+# arity -> literal defaults appended to calls with that many arguments, only
+# where a single overload accepts that arity
+def get_default_args(signatures):
+    default_args = []
+    for arity in range(get_max_arity(signatures)):
+        candidates = get_candidates(signatures, arity)
+        if len(candidates) != 1:
+            continue
+
+        tail = []
+        for default in candidates[0][1][arity:]:
+            if not default:
+                break
+            tail.append(default)
+        if tail:
+            trailing = "," if len(tail) == 1 else ""
+            default_args.append(f"{arity}: ({', '.join(tail)}{trailing})")
+    return default_args
+
+
 def generate_functions(outputs, functions):
     for name, nodes in functions.items():
         # first item always namespace
@@ -416,9 +612,21 @@ def generate_functions(outputs, functions):
             if node.raw_comment:
                 output.append(f"\"\"\"{node.raw_comment}\"\"\"")
 
+        # declared scalar parameter types (see canonicalize_args)
+        signatures = get_signatures(nodes[1:])
+        param_types = get_param_types(signatures)
+        if param_types:
+            output.append(f"_param_types[\"{name}\"] = {{{', '.join(param_types)}}}")
+
+        # literal defaults filled in before hashing (see fill_default_args)
+        default_args = get_default_args(signatures)
+        if default_args:
+            output.append(f"_default_args[\"{name}\"] = {{{', '.join(default_args)}}}")
+
         output.extend([
-            f"def {name}(*args, template_args=None, take_ownership=False):",
-            f"\treturn call_func(\"{name}\", _namespace, args, _includes, template_args, take_ownership)",
+            f"def {name}(*args, template_args=None, take_ownership=False, release_gil=None):",
+            f"\treturn call_func(\"{name}\", _namespace, args, _includes, template_args, take_ownership, release_gil, "
+                f"_param_types.get(\"{name}\"), _default_args.get(\"{name}\"))",
             "",
         ])
 
@@ -454,6 +662,38 @@ class Target(enum.Enum):
     thrust_omp = "Makefile.thrust_omp"
     thrust_cuda = "Makefile.thrust_cuda"
 
+# wrapper includes precompiled by the g++ Makefiles, used by every binding
+PCH_HEADER = "wayout_pch.hpp"
+def uses_pch(target):
+    return target not in (Target.kokkos_cuda, Target.thrust_cuda)
+
+
+# include lines of the class headers, the precompiled header stands in for the
+# wrapper includes so bindings never include them twice
+def get_header_includes(headers, target):
+    if uses_pch(target):
+        return [f"#include \"{PCH_HEADER}\""]
+    return [f"#include <{f}>" for f in headers] + [f"#include \"{CLASSES_HEADER}\""]
+
+
+def generate_pch(build_dir, headers, target):
+    if not uses_pch(target):
+        return
+
+    lines = ["#ifndef WAYOUT_PCH_HPP", "#define WAYOUT_PCH_HPP"]
+    lines.extend([f"#include <{f}>" for f in headers])
+    lines.append(f"#include \"{CLASSES_HEADER}\"")
+    lines.append("#endif")
+    with open(f"{build_dir}/{PCH_HEADER}", "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    try:
+        subprocess.run(['make', '-s', '-C', build_dir, f"{PCH_HEADER}.gch"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    except subprocess.CalledProcessError as e:
+        print(e.stderr.decode('utf-8'))
+        raise e
+
+
 def generate_wrapper(output_dir, paths, flags=[], target=Target.kokkos_omp):
     #FIXME need general way of getting header file name
     if "thrust" in output_dir:
@@ -468,25 +708,26 @@ def generate_wrapper(output_dir, paths, flags=[], target=Target.kokkos_omp):
     # cindex.Config.set_library_file(LIB_PATH)
     index = cindex.Index.create()
     preamble = [
-        "import re",
         "import sys",
 
         "import wayout",
         "from wayout.dynamic import *",
         "from build._kernel_enums import *",
         f"_includes = {include_str}",
-        "",
-        "_type_err_patt = re.compile(r\"-> (.*)\")",
         ""
     ]
 
     build_dir = output_dir + "/build/"
     makefile_path = Path(__file__).resolve().parent / target.value
+    helper_path = Path(__file__).resolve().parent / "wayout.hpp"
 
     os.system(f"mkdir -p {build_dir}")
     os.system(f"cp {makefile_path} {build_dir}/Makefile")
+    os.system(f"cp {helper_path} {build_dir}/wayout.hpp")
 
+    header_includes = get_header_includes(headers, target)
     enums = []
+    classes = {}
     parsed_paths = set(paths)
     queue = deque(paths)
     outputs = {}
@@ -504,10 +745,12 @@ def generate_wrapper(output_dir, paths, flags=[], target=Target.kokkos_omp):
 
         # output.append('# Translation unit:'+tu.spelling)
         functions = {}
-        traverse_ast(outputs, path, tu.cursor, 0, functions, enums, build_dir, headers)
+        traverse_ast(outputs, path, tu.cursor, 0, functions, enums, build_dir, header_includes, classes)
         generate_functions(outputs, functions)
 
     generate_enums(build_dir, enums, headers)
+    generate_classes_header(build_dir, classes)
+    generate_pch(build_dir, headers, target)
 
     # name of root module
     MODULE_NAME = "kernel"
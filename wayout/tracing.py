@@ -0,0 +1,234 @@
+"""
+tracing.py
+
+records one iteration of a loop over bindings and compiles it into a single
+native loop
+
+    with wayout.trace() as t:
+        r_old = t.scalar(r_old_dot)
+        KokkosSparse.spmv(char_ptr("N"), one, A, p, zero, Ap)
+        alpha = r_old / KokkosBlas.dot(p, Ap)
+        ...
+        t.update(r_old, r_dot)
+        t.loop_while(tolerance < t.cpp("std::sqrt", r_old))
+    k, r_old_dot = t.compile()(N)
+
+while tracing, calls of the tracing thread to generated functions and methods
+are recorded rather than executed and return symbolic values, which support
+scalar arithmetic and can be passed to later calls
+"""
+
+import hashlib
+
+from . import dynamic
+from .dynamic import _cpp_types, char_ptr, gen_params, get_cpp_name, get_handle, load_binding
+
+
+class Sym:
+    """symbolic value of a traced expression"""
+
+    def __init__(self, trace, expr, deps=frozenset(), carried=None):
+        self._trace = trace
+        self._expr = expr
+        # indices of recorded calls the expression reads
+        self._deps = deps
+        # index of the loop carried scalar this is
+        self._carried = carried
+
+    def _binary(self, other, op, reflected=False):
+        lhs, rhs = self._trace._operand(self), self._trace._operand(other)
+        if reflected:
+            lhs, rhs = rhs, lhs
+        deps = self._deps | getattr(other, "_deps", frozenset())
+        return Sym(self._trace, f"({lhs} {op} {rhs})", deps)
+
+    def __add__(self, other):
+        return self._binary(other, "+")
+
+    def __radd__(self, other):
+        return self._binary(other, "+", True)
+
+    def __sub__(self, other):
+        return self._binary(other, "-")
+
+    def __rsub__(self, other):
+        return self._binary(other, "-", True)
+
+    def __mul__(self, other):
+        return self._binary(other, "*")
+
+    def __rmul__(self, other):
+        return self._binary(other, "*", True)
+
+    def __truediv__(self, other):
+        return self._binary(other, "/")
+
+    def __rtruediv__(self, other):
+        return self._binary(other, "/", True)
+
+    def __neg__(self):
+        return Sym(self._trace, f"(-{self._expr})", self._deps)
+
+    def __lt__(self, other):
+        return self._binary(other, "<")
+
+    def __le__(self, other):
+        return self._binary(other, "<=")
+
+    def __gt__(self, other):
+        return self._binary(other, ">")
+
+    def __ge__(self, other):
+        return self._binary(other, ">=")
+
+    def __eq__(self, other):
+        return self._binary(other, "==")
+
+    def __ne__(self, other):
+        return self._binary(other, "!=")
+
+    # python's and/or cannot be overloaded
+    def __and__(self, other):
+        return self._binary(other, "&&")
+
+    def __or__(self, other):
+        return self._binary(other, "||")
+
+    __hash__ = object.__hash__
+
+    def __bool__(self):
+        raise TypeError("Symbolic value used in python control flow, use loop_while instead!")
+
+    def __float__(self):
+        raise TypeError("Symbolic value has no python value while tracing!")
+
+
+class Trace:
+    def __init__(self):
+        # python objects passed as parameters of the compiled function
+        self._args = []
+        self._arg_names = {}
+        self._includes = ["tuple", "cmath"]
+
+        # recorded call expressions and the ones whose result is read
+        self._calls = []
+        self._used = set()
+
+        # loop carried scalars: (cpp type, initial value, updated value)
+        self._carried = []
+        self._pred = None
+        self._compiled = None
+
+    def _param(self, obj):
+        name = self._arg_names.get(id(obj))
+        if name is None:
+            name = f"a{len(self._args)}"
+            self._args.append(obj)
+            self._arg_names[id(obj)] = name
+        return name
+
+    # cpp expression of an argument, python values become parameters
+    def _operand(self, obj):
+        if isinstance(obj, Sym):
+            if obj._trace is not self:
+                raise ValueError("Symbolic value belongs to another trace!")
+            self._used |= obj._deps
+            return obj._expr
+
+        name = self._param(obj)
+        if isinstance(obj, char_ptr):
+            return f"{name}.c_str()"
+        return name
+
+    def _add_includes(self, includes):
+        for include in includes:
+            if include not in self._includes:
+                self._includes.append(include)
+
+    def record(self, func, args, includes, inst=None):
+        self._add_includes(includes)
+        call_args = ",".join(self._operand(arg) for arg in args)
+        if inst is not None:
+            func = f"{self._operand(inst)}.{func}"
+
+        index = len(self._calls)
+        self._calls.append(f"{func}({call_args})")
+        return Sym(self, f"v{index}", frozenset([index]))
+
+    def scalar(self, init):
+        """loop carried scalar starting at init"""
+        if type(init) not in _cpp_types or _cpp_types[type(init)] in ("std::string", "void"):
+            raise TypeError(f"Invalid loop carried scalar {init}!")
+
+        index = len(self._carried)
+        self._carried.append([_cpp_types[type(init)], init, None])
+        return Sym(self, f"c{index}", carried=index)
+
+    def update(self, scalar, value):
+        """set value of scalar for the next iteration"""
+        if getattr(scalar, "_carried", None) is None or scalar._trace is not self:
+            raise ValueError("Only loop carried scalars can be updated!")
+        self._carried[scalar._carried][2] = self._operand(value)
+
+    def loop_while(self, pred):
+        """keep iterating while pred (evaluated before each iteration) holds"""
+        if isinstance(pred, Sym) and pred._deps:
+            raise ValueError("Loop predicate may only read loop carried scalars!")
+        self._pred = self._operand(pred)
+
+    def cpp(self, func, *args):
+        """inline call of a cpp function on scalars, e.g. t.cpp("std::sqrt", x)"""
+        deps = frozenset().union(*(getattr(arg, "_deps", frozenset()) for arg in args))
+        return Sym(self, f"{func}({','.join(self._operand(arg) for arg in args)})", deps)
+
+    def compile(self):
+        """callable running the loop for at most max_iter iterations, returns
+        the number of iterations and the final loop carried scalars"""
+        if self._pred is None:
+            raise ValueError("Loop predicate not set, call loop_while first!")
+
+        if self._compiled is None:
+            params = gen_params(self._args)
+            params.extend(f"{typename} c{i}_init" for i, (typename, _, _) in enumerate(self._carried))
+            params.append("int max_iter")
+
+            body = [f"{typename} c{i} = c{i}_init;" for i, (typename, _, _) in enumerate(self._carried)]
+            body.append("int k = 0;")
+            body.append(f"while (k < max_iter && {self._pred}) {{")
+            for i, call in enumerate(self._calls):
+                # results nobody reads may be void
+                body.append(f"auto v{i} = {call};" if i in self._used else f"{call};")
+            # all updates see the values of this iteration
+            updated = [i for i, (_, _, value) in enumerate(self._carried) if value is not None]
+            body.extend(f"auto n{i} = {self._carried[i][2]};" for i in updated)
+            body.extend(f"c{i} = n{i};" for i in updated)
+            body.append("k++;}")
+            body.append(f"return std::make_tuple({','.join(['k'] + [f'c{i}' for i in range(len(self._carried))])});")
+            body = "".join(body)
+
+            source = ",".join(self._includes) + ",".join(params) + body
+            name_hash = "f_" + hashlib.sha1(source.encode('utf-8')).hexdigest()
+            dynamic.generated_kernels.add("trace")
+            mod = load_binding(name_hash, self._includes, params, body, False)
+            self._compiled = getattr(mod, name_hash)
+
+        func = self._compiled
+        handles = [get_handle(arg) for arg in self._args]
+        inits = [init for _, init, _ in self._carried]
+        def run(max_iter):
+            return func(*handles, *inits, max_iter)
+        return run
+
+    def __enter__(self):
+        if dynamic.get_tracer() is not None:
+            raise RuntimeError("Nested traces are not supported!")
+        dynamic.set_tracer(self)
+        return self
+
+    def __exit__(self, *exc):
+        dynamic.set_tracer(None)
+        return False
+
+
+def trace():
+    return Trace()
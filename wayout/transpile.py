@@ -0,0 +1,244 @@
+"""
+transpile.py
+
+translates small python functions on scalars into cpp functors (see
+wayout.functor), so predicates and operators of algorithms can be written in
+python
+
+    a = 2.0
+    transform(X.begin(), X.end(), Y.begin(), Y.begin(), wayout.to_functor(lambda x, y: a * x + y))
+
+supported are lambdas and defs made of local assignments and a return,
+arithmetic, comparisons, boolean operators, conditional expressions and math
+functions, / and % follow python (true division, the remainder takes the sign
+of the divisor) but division by zero is not checked and float operands keep
+their precision
+scalars the function reads from its closure or globals become members of the
+functor, initialized with their current values at each call
+"""
+
+import ast
+import hashlib
+import inspect
+import linecache
+import math
+
+from .dynamic import _cpp_types
+from .functor import functor, get_default_includes
+
+_BIN_OPS = {
+    ast.Add: "+", ast.Sub: "-", ast.Mult: "*",
+    ast.BitAnd: "&", ast.BitOr: "|", ast.BitXor: "^", ast.LShift: "<<", ast.RShift: ">>",
+}
+_UNARY_OPS = {ast.USub: "-", ast.UAdd: "+", ast.Not: "!", ast.Invert: "~"}
+_BOOL_OPS = {ast.And: "&&", ast.Or: "||"}
+_CMP_OPS = {ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+
+# python function -> cpp function
+_FUNCS = {math.__dict__[name]: f"std::{name}" for name in [
+    "sqrt", "exp", "log", "log10", "log2", "sin", "cos", "tan", "asin", "acos", "atan", "atan2",
+    "sinh", "cosh", "tanh", "floor", "ceil", "fabs", "pow", "hypot", "fmod", "erf", "erfc",
+    "isnan", "isinf", "isfinite",
+]}
+_FUNCS[abs] = "std::abs"
+
+# translations keyed by bytecode hash: (expr, captured names)
+_translations = {}
+
+
+class _Translator:
+    def __init__(self, fn, params):
+        self._fn = fn
+        self._params = set(params)
+        self._locals = set()
+        # names read from closure or globals, in order of first use
+        self._captured = []
+        self._closure = inspect.getclosurevars(fn)
+
+    def _lookup(self, name):
+        if name in self._closure.nonlocals:
+            return self._closure.nonlocals[name]
+        if name in self._closure.globals:
+            return self._closure.globals[name]
+        if name in self._closure.builtins:
+            return self._closure.builtins[name]
+        raise NameError(f"Name {name} is not defined!")
+
+    # python value of a name or attribute (e.g. math.sqrt), None if unknown
+    def _resolve(self, node):
+        if isinstance(node, ast.Name) and node.id not in self._params and node.id not in self._locals:
+            return self._lookup(node.id)
+        if isinstance(node, ast.Attribute):
+            value = self._resolve(node.value)
+            if inspect.ismodule(value):
+                return getattr(value, node.attr)
+        return None
+
+    def error(self, node, msg="Unsupported construct"):
+        return NotImplementedError(f"{msg} in {self._fn.__name__}: {ast.dump(node)}")
+
+    def expr(self, node):
+        if isinstance(node, ast.Constant):
+            return self.const(node, node.value)
+        elif isinstance(node, ast.Name):
+            if node.id in self._params:
+                return f"p_{node.id}"
+            if node.id in self._locals:
+                return f"v_{node.id}"
+            value = self._lookup(node.id)
+            if type(value) not in _cpp_types or _cpp_types[type(value)] in ("std::string", "void"):
+                raise self.error(node, f"Captured {node.id} is not a scalar")
+            if node.id not in self._captured:
+                self._captured.append(node.id)
+            return f"m_{node.id}"
+        elif isinstance(node, ast.Attribute):
+            # module constants, e.g. math.pi
+            value = self._resolve(node)
+            if type(value) in (int, float, bool):
+                return self.const(node, value)
+            raise self.error(node)
+        elif isinstance(node, ast.BinOp):
+            if isinstance(node.op, ast.Pow):
+                return f"std::pow({self.expr(node.left)}, {self.expr(node.right)})"
+            if isinstance(node.op, ast.Div):
+                return f"wayout::py_div({self.expr(node.left)}, {self.expr(node.right)})"
+            if isinstance(node.op, ast.Mod):
+                return f"wayout::py_mod({self.expr(node.left)}, {self.expr(node.right)})"
+            if type(node.op) not in _BIN_OPS:
+                raise self.error(node)
+            return f"({self.expr(node.left)} {_BIN_OPS[type(node.op)]} {self.expr(node.right)})"
+        elif isinstance(node, ast.UnaryOp):
+            return f"({_UNARY_OPS[type(node.op)]}{self.expr(node.operand)})"
+        elif isinstance(node, ast.BoolOp):
+            return "(" + f" {_BOOL_OPS[type(node.op)]} ".join(self.expr(v) for v in node.values) + ")"
+        elif isinstance(node, ast.Compare):
+            # chained comparisons evaluate each operand once in python, the
+            # operands here are side effect free
+            operands = [node.left] + node.comparators
+            parts = []
+            for op, lhs, rhs in zip(node.ops, operands, operands[1:]):
+                if type(op) not in _CMP_OPS:
+                    raise self.error(node)
+                parts.append(f"({self.expr(lhs)} {_CMP_OPS[type(op)]} {self.expr(rhs)})")
+            return parts[0] if len(parts) == 1 else "(" + " && ".join(parts) + ")"
+        elif isinstance(node, ast.IfExp):
+            return f"({self.expr(node.test)} ? {self.expr(node.body)} : {self.expr(node.orelse)})"
+        elif isinstance(node, ast.Call):
+            if node.keywords:
+                raise self.error(node)
+            func = self._resolve(node.func)
+            args = [self.expr(arg) for arg in node.args]
+            if func in _FUNCS:
+                return f"{_FUNCS[func]}({', '.join(args)})"
+            elif func in (min, max) and len(args) == 2:
+                op = "<" if func is min else ">"
+                return f"({args[0]} {op} {args[1]} ? {args[0]} : {args[1]})"
+            elif func in (float, int, bool) and len(args) == 1:
+                return f"static_cast<{_cpp_types[func]}>({args[0]})"
+            raise self.error(node, "Unsupported function")
+        raise self.error(node)
+
+    def const(self, node, value):
+        if type(value) is bool:
+            return "true" if value else "false"
+        elif type(value) is int:
+            return str(value)
+        elif type(value) is float and math.isfinite(value):
+            return repr(value)
+        raise self.error(node, "Unsupported constant")
+
+    def body(self, stmts):
+        lines = []
+        for stmt in stmts:
+            if isinstance(stmt, ast.Return) and stmt is stmts[-1] and stmt.value is not None:
+                lines.append(f"return {self.expr(stmt.value)};")
+            elif isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+                name = stmt.targets[0].id
+                if name in self._params or name in self._locals:
+                    raise self.error(stmt, "Reassignment")
+                value = self.expr(stmt.value)
+                self._locals.add(name)
+                lines.append(f"auto v_{name} = {value};")
+            elif isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) and stmt is stmts[0]:
+                # docstring
+                continue
+            else:
+                raise self.error(stmt)
+        if not lines or not lines[-1].startswith("return"):
+            raise NotImplementedError(f"{self._fn.__name__} has to end with a return!")
+        return lines
+
+
+# ast of the lambda or def compiled into the code of fn
+def get_function_ast(fn):
+    code = fn.__code__
+    lines = linecache.getlines(code.co_filename)
+    if not lines:
+        raise ValueError(f"Source of {fn.__name__} is not available!")
+    # whole file, a lambda may sit inside a multi-line statement
+    tree = ast.parse("".join(lines))
+
+    params = list(code.co_varnames[:code.co_argcount])
+    candidates = []
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Lambda, ast.FunctionDef)):
+            lineno = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+            if lineno == code.co_firstlineno and [a.arg for a in node.args.args] == params:
+                if isinstance(node, ast.FunctionDef) == (fn.__name__ != "<lambda>"):
+                    candidates.append(node)
+
+    if len(candidates) > 1 and hasattr(code, "co_positions"):
+        # lambdas sharing a line, keep the innermost one spanning all
+        # instructions of fn
+        positions = [(line, col) for line, end_line, col, end_col in code.co_positions()
+                     if col is not None and (line, col) < (end_line, end_col)]
+        candidates = [node for node in candidates if all(
+            (node.lineno, node.col_offset) <= pos <= (node.end_lineno, node.end_col_offset) for pos in positions)]
+        candidates = sorted(candidates, key=lambda node: (node.lineno, node.col_offset))[-1:]
+
+    if len(candidates) != 1:
+        raise ValueError(f"Cannot locate source of {fn.__name__}, define one lambda per line!")
+    return candidates[0]
+
+
+# hash of the bytecode of fn, identical code translates identically
+def get_code_hash(fn):
+    code = fn.__code__
+    key = [code.co_filename, code.co_code, code.co_consts, code.co_names, code.co_varnames, code.co_freevars]
+    return hashlib.sha1("".join(map(repr, key)).encode('utf-8')).hexdigest()
+
+
+def translate(fn):
+    """(expr, captured names) of the cpp functor equivalent to fn"""
+    node = get_function_ast(fn)
+    if node.args.vararg or node.args.kwarg or node.args.kwonlyargs or node.args.defaults:
+        raise NotImplementedError(f"{fn.__name__} may only take positional parameters without defaults!")
+
+    params = [a.arg for a in node.args.args]
+    translator = _Translator(fn, params)
+    if isinstance(node, ast.Lambda):
+        expr = translator.expr(node.body)
+    else:
+        expr = "{" + "".join(translator.body(node.body)) + "}"
+
+    params = ", ".join(f"p_{p}" for p in params)
+    return f"({params}) -> {expr}", translator._captured
+
+
+def to_functor(fn, includes=None):
+    """functor instance equivalent to the python function fn, see functor()"""
+    key = get_code_hash(fn)
+    translation = _translations.get(key)
+    if translation is None:
+        translation = _translations[key] = translate(fn)
+    expr, captured = translation
+
+    # captured values are read at each call, their types select the members
+    closure = inspect.getclosurevars(fn)
+    values = [closure.nonlocals[name] if name in closure.nonlocals else closure.globals[name] for name in captured]
+    members = [f"{_cpp_types[type(v)]} m_{name}" for name, v in zip(captured, values)]
+
+    includes = get_default_includes() if includes is None else list(includes)
+    if "cmath" not in includes:
+        includes.append("cmath")
+    return functor(members, expr, includes)(*values)
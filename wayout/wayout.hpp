@@ -0,0 +1,168 @@
+// helpers shared by generated bindings, copied into every build directory
+#pragma once
+
+#include <pybind11/pybind11.h>
+
+#include <cmath>
+#include <string>
+#include <type_traits>
+#include <utility>
+
+// functions callable from host and device code (see wayout.functor)
+#ifdef __CUDACC__
+#define WAYOUT_HOST_DEVICE __host__ __device__
+#else
+#define WAYOUT_HOST_DEVICE
+#endif
+
+namespace wayout {
+
+// return type of a (binding) function
+template <typename R, typename... A>
+R ret_type(R (*)(A...));
+
+// cpp name of T if passing it to python needs a class registration first,
+// None if T is already registered or converted by a builtin caster
+template <typename R>
+pybind11::object unregistered_type() {
+    using T = pybind11::detail::intrinsic_t<R>;
+    using caster = pybind11::detail::make_caster<T>;
+
+    if (std::is_base_of<pybind11::detail::type_caster_generic, caster>::value &&
+            pybind11::detail::get_type_info(typeid(T)) == nullptr) {
+        return pybind11::str(pybind11::type_id<T>());
+    }
+    return pybind11::none();
+}
+
+// element type of a container indexed with operator[], value_type if declared
+// (operator[] may return a proxy such as thrust::device_reference)
+template <typename C, typename = void>
+struct element {
+    using type = typename std::decay<decltype(std::declval<C &>()[0])>::type;
+};
+
+template <typename C>
+struct element<C, pybind11::detail::void_t<typename C::value_type>> {
+    using type = typename C::value_type;
+};
+
+template <typename C>
+using element_t = typename element<typename std::decay<C>::type>::type;
+
+// python modulo of integers, the result takes the sign of the divisor
+template <typename A, typename B>
+WAYOUT_HOST_DEVICE auto py_mod(A a, B b)
+        -> typename std::enable_if<std::is_integral<A>::value && std::is_integral<B>::value, decltype(a % b)>::type {
+    auto r = a % b;
+    return (r != 0 && (r < 0) != (b < 0)) ? r + b : r;
+}
+
+// python modulo of floating point numbers (see wayout.transpile), in their
+// own precision
+template <typename A, typename B>
+WAYOUT_HOST_DEVICE auto py_mod(A a, B b)
+        -> typename std::enable_if<!(std::is_integral<A>::value && std::is_integral<B>::value), typename std::common_type<A, B>::type>::type {
+    using T = typename std::common_type<A, B>::type;
+    T r = std::fmod(static_cast<T>(a), static_cast<T>(b));
+    return (r != 0 && (r < 0) != (b < 0)) ? r + b : r;
+}
+
+// python true division, integers are divided as double
+template <typename A, typename B>
+WAYOUT_HOST_DEVICE auto py_div(A a, B b)
+        -> typename std::enable_if<std::is_integral<A>::value && std::is_integral<B>::value, double>::type {
+    return static_cast<double>(a) / b;
+}
+
+// division of floating point numbers keeps their precision
+template <typename A, typename B>
+WAYOUT_HOST_DEVICE auto py_div(A a, B b)
+        -> typename std::enable_if<!(std::is_integral<A>::value && std::is_integral<B>::value), decltype(a / b)>::type {
+    return a / b;
+}
+
+// containers whose data() is a raw pointer to size() arithmetic elements,
+// Kokkos views (memory_space) may be strided or on device and are left out
+template <typename T>
+using data_t = typename std::remove_pointer<decltype(std::declval<T &>().data())>::type;
+
+template <typename T, typename = void>
+struct has_memory_space : std::false_type {};
+
+template <typename T>
+struct has_memory_space<T, pybind11::detail::void_t<typename T::memory_space>> : std::true_type {};
+
+template <typename T, typename = void>
+struct is_contiguous : std::false_type {};
+
+template <typename T>
+struct is_contiguous<T, pybind11::detail::void_t<decltype(std::declval<T &>().size()), data_t<T>>>
+    : std::integral_constant<bool,
+        std::is_pointer<decltype(std::declval<T &>().data())>::value &&
+        std::is_arithmetic<typename std::remove_cv<data_t<T>>::type>::value &&
+        !has_memory_space<T>::value> {};
+
+namespace detail {
+
+template <typename T>
+pybind11::class_<T> make_class(pybind11::module &mod, const char *name, std::false_type) {
+    return pybind11::class_<T>(mod, name);
+}
+
+template <typename T>
+pybind11::class_<T> make_class(pybind11::module &mod, const char *name, std::true_type) {
+    using V = typename std::remove_cv<data_t<T>>::type;
+
+    pybind11::class_<T> cls(mod, name, pybind11::buffer_protocol());
+    cls.def_buffer([](T &c) {
+        return pybind11::buffer_info(const_cast<V *>(c.data()), sizeof(V),
+                pybind11::format_descriptor<V>::format(), 1,
+                {static_cast<pybind11::ssize_t>(c.size())}, {static_cast<pybind11::ssize_t>(sizeof(V))});
+    });
+    return cls;
+}
+
+}
+
+// pybind class of T, exposing the buffer protocol for contiguous containers
+template <typename T>
+pybind11::class_<T> make_class(pybind11::module &mod, const char *name) {
+    return detail::make_class<T>(mod, name, is_contiguous<T>());
+}
+
+// specialized in wayout_classes.hpp for class templates it can register
+template <typename T>
+struct registrar : std::false_type {};
+
+namespace detail {
+
+template <typename T>
+void register_class(pybind11::module &, const char *, const char *, std::false_type) {}
+
+template <typename T>
+void register_class(pybind11::module &mod, const char *name, const char *cpp_type, std::true_type) {
+    registrar<T>::generate(mod, name, cpp_type);
+}
+
+}
+
+// like unregistered_type, but registers the class of R in mod when a
+// registrar exists for it, so no separate class module has to be built
+template <typename R>
+pybind11::object register_return(pybind11::module &mod, const char *name, const char *cpp_type = nullptr) {
+    using T = pybind11::detail::intrinsic_t<R>;
+
+    pybind11::object ret_type = unregistered_type<R>();
+    if (ret_type.is_none() || !registrar<T>::value) {
+        return ret_type;
+    }
+
+    // generated classes keep the pointer to their cpp type
+    static const std::string type_name = pybind11::type_id<T>();
+    detail::register_class<T>(mod, name, cpp_type ? cpp_type : type_name.c_str(),
+            std::integral_constant<bool, registrar<T>::value>());
+    return pybind11::none();
+}
+
+}